@@ -45,7 +45,8 @@ def MakeCircleToXY(radius, phi, center=(0, 0)):
     return coord
 
 
-def MakeProgressArc(axis, radius, begin, end, n, color, center=(0, 0)):
+def MakeProgressArc(axis, radius, begin, end, n, color, center=(0, 0),
+                    cmap_colors=('white', 'midnightblue')):
     """
     Makes the required curve with the color progressing points.
     :param axis: Current axis.
@@ -55,6 +56,8 @@ def MakeProgressArc(axis, radius, begin, end, n, color, center=(0, 0)):
     :param n: Number of evenly spaced points.
     :param color: Color of the line below the points.
     :param center: Center of the circle.
+    :param cmap_colors: First and last color of the point colormap.
+    :return: The list of the point artists, so they can be recolored later.
     """
 
     xc, yc = center
@@ -103,28 +106,51 @@ def MakeProgressArc(axis, radius, begin, end, n, color, center=(0, 0)):
     # A második ['white', 'midnightblue'] pedig a range-et mondja meg
     # Tehát 'white'-tól, 'midnightblue'-ig menjen a colormap
     
+    # Ezt a 'ColorPoints' függvény csinálja, hogy később újra lehessen színezni a pontokat
+    #
+    # Egy for ciklussal végig megyünk a pontokon, és kiplotoljuk őket
+    # A pontokat eltesszük egy listába, hogy később újra lehessen színezni őket
+    point_artists = []
+    for i in range(n):
+        # És kiplotoljuk a ponot minden alkalommal
+        # Ehhez kell a pontok x és y koordinátájának (xp, és yp) i-edik eleme
+        # És az 'o' modja meg hogy pontok legyenek
+        point, = axis.plot(xp[i], yp[i], 'o', markersize=4, markeredgewidth=0.8)
+        point_artists.append(point)
+
+    ColorPoints(point_artists, cmap_colors, color)
+
+    return point_artists
+
+
+def ColorPoints(point_artists, cmap_colors=('white', 'midnightblue'), edgecolor='darkslateblue'):
+    """
+    Colors the points of one progress arc, from the first to the last color of the colormap.
+    :param point_artists: The list of the point artists of one arc.
+    :param cmap_colors: First and last color of the point colormap.
+    :param edgecolor: Edge color of the points.
+    """
+
     # Ezt el is nevezzük cmap-nak, mint colormap
     cmap = mpl.colors.LinearSegmentedColormap.from_list('white_blue',
-                                                        ['white', 'midnightblue'])
+                                                        list(cmap_colors))
 
     # És most jön a varázslat
     # A cmap, csak 0 és 1 közt tud színt rendelni egy pontunkhoz
     # Ezért az i-edik színt 0 és 1 közé kell beszorítani
-    # Egy for ciklussal végig megyünk 0-tól 1-ig az icolorral, majd plotoljuk azt a pontot icolor színnel
-    for i in range(n):
+    n = len(point_artists)
+    for i, point in enumerate(point_artists):
         # A pythonban az indexelés 0-tól indul és n-1-el végződik
         # Magyarul ha n= 19 akkor 19 pontod lesz de az intervallum 0-18-ig megy
         # ezért hogy 0-1 közt legyünk leosztunk (n-1)-el
-        # pl.: 0/18, 1/18, 2/18, 3/18 . . . 18/18 
-        icolor = i / (n - 1)
+        # pl.: 0/18, 1/18, 2/18, 3/18 . . . 18/18
+        # (egyetlen pontnál nincs mivel osztani, az a kezdő színt kapja)
+        icolor = i / (n - 1) if n > 1 else 0.0
 
-        # És kiplotoljuk a ponot minden alkalommal
-        # Ehhez kell a pontok x és y koordinátájának (xp, és yp) i-edik eleme
-        # És az 'o' modja meg hogy pontok legyenek
         # A színt pedig a markerfacecolor-nak ekll beadni
         # Ami természetesen a colormap-nek (cmap) az i-edik színe lesz (icolor)
-        axis.plot(xp[i], yp[i], 'o', markersize=4, markeredgewidth=0.8,
-                  markerfacecolor=cmap(icolor), markeredgecolor=color)
+        point.set_markerfacecolor(cmap(icolor))
+        point.set_markeredgecolor(edgecolor)
 
 
 def MakeArcArrow(axis, radius, begin, end, color, center=(0, 0)):
@@ -291,6 +317,7 @@ def texts():
 def axis1():
     """
     This plots everything for 'ax1'. The patches, then initials, and the arcs and arrows.
+    :return: The point artists of the progress arc.
     """
 
     # Patches
@@ -300,12 +327,13 @@ def axis1():
     initials(ax1)
 
     MakeArcArrow(ax1, 6, 45, 180 + 30, 'darkslateblue')
-    MakeProgressArc(ax1, 8, 1.5, 358.5, 19, 'darkslateblue')
+    return MakeProgressArc(ax1, 8, 1.5, 358.5, 19, 'darkslateblue')
 
 
 def axis2():
     """
     This plots everything for 'ax2'. The patches, then initials, and the arcs and arrows.
+    :return: The point artists of the progress arc.
     """
 
     # Patches
@@ -321,9 +349,11 @@ def axis2():
     initials(ax2)
 
     circle = ax2.add_patch(plt.Circle((0, 0), 8, fill=False, color='darkslateblue', linewidth=1))
-    MakeProgressArc(ax2, 8, 0, 90 + 30, 19, 'darkslateblue')
+    points = MakeProgressArc(ax2, 8, 0, 90 + 30, 19, 'darkslateblue')
     MakeArcArrow(ax2, 6.5, 40, 90, 'darkslateblue')
 
+    return points
+
 
 def axis_int():
     """
@@ -348,17 +378,68 @@ def axis_int():
 # -----------------------------------------------------------
 
 
+class FigureTemplate:
+    """
+    Builds the static parts of the figure (axes, patches, arrows, texts) only once,
+    and keeps the artists of the progress points. Redrawing or exporting a variant
+    only recolors these points, instead of rebuilding every axis.
+    """
+
+    def __init__(self):
+        self.figure = fig
+        # One list of point artists per progress arc
+        self.arcs = []
+        self.built = False
+
+    def build(self):
+        """
+        Creates the static parts of the figure, if it has not been done yet.
+        """
+
+        if self.built:
+            return
+
+        self.arcs = [axis1(), axis2()]
+        axis_int()
+
+        texts()
+
+        self.built = True
+
+    def update(self, cmap_colors=('white', 'midnightblue'), edgecolor='darkslateblue'):
+        """
+        Recolors the cached progress points, nothing else is touched.
+        :param cmap_colors: First and last color of the point colormap.
+        :param edgecolor: Edge color of the points.
+        """
+
+        self.build()
+
+        # Every arc runs through the whole colormap, with its own number of points.
+        for points in self.arcs:
+            ColorPoints(points, cmap_colors, edgecolor)
+
+    def export(self, filename, **variant):
+        """
+        Saves a variant of the figure, reusing the cached artists.
+        :param filename: Name of the output file.
+        :param variant: Keyword arguments for 'update()'.
+        """
+
+        self.update(**variant)
+        self.figure.savefig(filename)
+
+
+template = FigureTemplate()
+
+
 def plot():
     """
     The main plot function. Ultimately this creates the image.
-    It combines all axis functions and the 'texts()' function.
+    It combines all axis functions and the 'texts()' function through the cached template.
     """
 
-    axis1()
-    axis2()
-    axis_int()
-
-    texts()
+    template.build()
 
     plt.show()
 
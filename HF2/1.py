@@ -1,6 +1,5 @@
 import numpy as np
 import matplotlib.pyplot as plt
-import itertools as itr
 
 # -------------------------------------------------------
 # Data
@@ -64,6 +63,47 @@ def identify_curse(A, B):
         raise ValueError("Could not identify curse!")
 
 
+def identify_curses(A, B, cond_limit=1e12):
+    """
+    Identifies many curses at once. The stacked systems are solved with one batched
+    LU solve, near-singular A matrices get the least-squares solution (pseudo-inverse) instead.
+    Nothing is raised, the failed items are only flagged.
+    :param A: Stacked original stat matrices, (K, 5, 5)
+    :param B: Stacked cursed stat matrices, (K, 5, 5)
+    :param cond_limit: Above this condition number the least-squares fallback is used
+    :return: The curse matrices (K, 5, 5), the relative residuals (K,) and the success flags (K,)
+    """
+
+    A = np.asarray(A, dtype=float)
+    B = np.asarray(B, dtype=float)
+
+    C = np.full_like(B, np.nan)
+
+    # Items with nan or inf entries are left as nan and flagged as failed
+    finite = np.all(np.isfinite(A), axis=(1, 2)) & np.all(np.isfinite(B), axis=(1, 2))
+    cond = np.full(len(A), np.inf)
+    cond[finite] = np.linalg.cond(A[finite])
+
+    regular = finite & (cond < cond_limit)
+    singular = finite & ~regular
+
+    # Same as in 'identify_curse': At Ct = Bt
+    if regular.any():
+        A_T = np.swapaxes(A[regular], -1, -2)
+        B_T = np.swapaxes(B[regular], -1, -2)
+        C[regular] = np.swapaxes(np.linalg.solve(A_T, B_T), -1, -2)
+
+    if singular.any():
+        C[singular] = B[singular] @ np.linalg.pinv(A[singular])
+
+    CA = C @ A
+    residuals = (np.linalg.norm(CA - B, axis=(1, 2)) /
+                 np.maximum(np.linalg.norm(B, axis=(1, 2)), np.finfo(float).tiny))
+    success = np.all(np.isclose(CA, B), axis=(1, 2))
+
+    return C, residuals, success
+
+
 def inverse_curse(C):
     """
     Returns the inverse of the curse matrix C.
@@ -74,27 +114,97 @@ def inverse_curse(C):
     return np.linalg.inv(C)
 
 
-def find_remedy_sequence(target, remedies):
+def find_remedy_sequence(target, remedies, max_depth=None, repeat=False, method="dfs",
+                         max_frontier=10**5):
     """
-    This function finds the suitable remedy sequence with brute force.
+    This function finds the suitable remedy sequence, searching the lengths 1, 2, ... level by level,
+    and stopping at the first length with a hit. The products of a level are kept stacked, and the
+    next level is made from them with one matrix product (see 'ExpandLevel'), so every prefix product
+    is computed only once. If a level would have more than 'max_frontier' sequences, the last stored
+    level is continued with an iterative deepening depth-first search instead (see 'RemedyDFS').
+    Branches whose determinant can no longer reach the determinant of the target are cut,
+    with a tolerance derived from the final 'isclose' comparison (see 'LogDetTolerance'),
+    so without repetition the result is the same as the brute force search over the permutations:
+    the shortest sequence, the first one in their order among those.
+    With method="mitm" the sequences are split into two halves, which are met in the middle,
+    so a sequence of length L over k remedies costs about k^(L/2) instead of k^L.
     :param target: The target matrix
     :param remedies: Dictionary of remedies
+    :param max_depth: Maximal length of the sequence, by default the number of remedies
+    :param repeat: If True, one remedy can be used more than once
+    :param method: "dfs" for the level by level (and depth-first) search, "mitm" for the meet-in-the-middle search
+    :param max_frontier: Largest number of stored sequences of one level
     :return: List of remedy keys, in the correct order.
     """
 
-    keys = list(remedies.keys())
+    if method not in ("dfs", "mitm"):
+        raise ValueError(f"Unknown search method: {method}")
 
-    # Number of keys
-    for i in range(1, len(keys) + 1):
-        # One permutation
-        for j in itr.permutations(keys, i):
-            result = np.eye(5)
-            # Apply j to result
-            for k in j:
-                result = remedies[k] @ result
-            # Check if correct
-            if np.allclose(result, target):
-                return list(j)
+    keys = list(remedies.keys())
+    G = np.array([remedies[k] for k in keys], dtype=float)
+    size = len(target)
+
+    if max_depth is None:
+        max_depth = len(keys)
+    if not repeat:
+        max_depth = min(max_depth, len(keys))
+
+    # The determinant is multiplicative, so log|det| of a sequence is a sum
+    sign_target, log_target = np.linalg.slogdet(target)
+    signs, log_dets = np.linalg.slogdet(G)
+
+    # The pruning is only safe, if 'isclose' can not accept a very different determinant,
+    # and then a singular remedy can never give the target either
+    log_tol = LogDetTolerance(target) if sign_target != 0 else np.inf
+    prune = np.isfinite(log_tol)
+    usable = signs != 0 if prune else np.ones(len(keys), dtype=bool)
+    log_dets = np.where(usable, log_dets, 0.0)
+
+    # allclose on the whole matrix bounds the difference of the traces
+    trace_target = np.trace(target)
+    trace_tol = np.sum(1e-8 + 1e-5 * np.abs(np.diag(target)))
+
+    if method == "mitm":
+        usable_idx = np.flatnonzero(usable)
+        for depth in range(1, max_depth + 1):
+            sequence = RemedyMITM(G[usable_idx], depth, repeat, target)
+            if sequence is not None:
+                return [keys[usable_idx[i]] for i in sequence]
+
+        raise ValueError("Could not identify a suitable remedy sequence!")
+
+    reach = ReachableLogDets(log_dets[usable], max_depth) if prune else None
+    reach_up_to = ReachableUpTo(reach) if prune else None
+
+    # The stored level: products, remedy indices and log|det| of its sequences
+    products = np.eye(size)[None]
+    indices = np.zeros((1, 0), dtype=int)
+    log_products = np.zeros(1)
+
+    for depth in range(1, max_depth + 1):
+        if len(indices) * np.count_nonzero(usable) <= max_frontier:
+            # A child can still become the target with at most max_depth - depth more remedies
+            def keep(log_children):
+                if reach_up_to is None:
+                    return np.ones(len(log_children), dtype=bool)
+                return CanReach(reach_up_to, max_depth - depth, log_target - log_children, log_tol)
+
+            products, indices, log_products = ExpandLevel(G, usable, log_dets, products, indices,
+                                                          log_products, repeat, keep)
+
+            hits = MatchTarget(products, target, trace_target, trace_tol)
+            if len(hits):
+                return [keys[i] for i in indices[hits[0]]]
+            if len(indices) == 0:
+                break
+            continue
+
+        # The level would be too large: every stored sequence is continued depth-first, in order
+        for prefix, path, log_prefix in zip(products, indices, log_products):
+            sequence = RemedyDFS(G, usable, log_dets, prefix, log_prefix, list(path), depth, repeat,
+                                 target, log_target, trace_target, trace_tol, reach, log_tol)
+            if sequence is not None:
+                return [keys[i] for i in sequence]
 
     raise ValueError("Could not identify a suitable remedy sequence!")
 
@@ -144,32 +254,314 @@ def CheckArec(CursedMatrix, remedies, sequence, A):
     :return: Recreated original stat matrix
     """
 
-    A_rec = apply_remedy_sequence(CursedMatrix, remedies, sequence)
+    # Only the last state is needed, the chain is not stored
+    for A_rec in IterStates(CursedMatrix, remedies, sequence):
+        pass
 
     if np.allclose(A_rec, A):
-        return A_rec
+        return A_rec.copy()
     else:
         raise ValueError("The reconstructed A doesn't match with the original.")
 
 
-def MakeStates(CursedMatrix, remedies, sequence):
+def ReachableLogDets(log_dets, depth, limit=10**6):
     """
-    This function makes a list from all the states of B (Cursed Matrix)
+    Collects the possible log|det| sums of 0, 1, ..., depth - 1 remedies (with repetition,
+    which is a superset of the cases without it), for pruning the search.
+    :param log_dets: log|det| of the usable remedies
+    :param depth: Length of the searched sequences
+    :param limit: Above this many distinct sums only the [min, max] interval is kept
+    :return: List of sorted arrays or (min, max) tuples, indexed by the remaining length
+    """
+
+    values = np.unique(np.round(log_dets, 9))
+    reach = [np.zeros(1)]
+
+    for _ in range(1, depth):
+        last = reach[-1]
+        if isinstance(last, tuple) or len(last) * len(values) > limit:
+            low, high = (last[0], last[-1]) if not isinstance(last, tuple) else last
+            reach.append((low + values[0], high + values[-1]))
+        else:
+            reach.append(np.unique(np.round(np.add.outer(last, values).ravel(), 9)))
+
+    return reach
+
+
+def ReachableUpTo(reach):
+    """
+    Merges the reachable log|det| sums, so the r-th entry holds the sums of at most r remedies.
+    Where an interval is involved, only the hull of the union is kept, which is still safe for pruning.
+    :param reach: Output of 'ReachableLogDets'
+    :return: List of sorted arrays or (min, max) tuples, indexed by the maximal remaining length
+    """
+
+    merged = [reach[0]]
+
+    for sums in reach[1:]:
+        last = merged[-1]
+        if isinstance(last, tuple) or isinstance(sums, tuple):
+            low = min(last[0], sums[0])
+            high = max(last[-1], sums[-1])
+            merged.append((low, high))
+        else:
+            merged.append(np.union1d(last, sums))
+
+    return merged
+
+
+def LogDetTolerance(target, rtol=1e-5, atol=1e-8, floor=1e-6):
+    """
+    Bounds how far log|det| of a matrix accepted by 'np.isclose(matrix, target)' can be from
+    log|det(target)|. For matrix = target + E, det(matrix) / det(target) = det(I + inverse(target) @ E),
+    so with e = ||inverse(target)||_2 ||E||_F < 1 the difference is at most -n log(1 - e).
+    For a (nearly) singular target there is no such bound, and the pruning has to be turned off.
+    :param target: The target matrix
+    :param rtol: Relative tolerance of 'isclose'
+    :param atol: Absolute tolerance of 'isclose'
+    :param floor: Smallest tolerance, for the rounding of the sums in 'ReachableLogDets'
+    :return: The tolerance, or inf if the pruning is not safe
+    """
+
+    # ||inverse(target)||_2 is 1 / (smallest singular value), pinv would cut the tiny ones off
+    sigma_min = np.linalg.svd(target, compute_uv=False)[-1]
+    eps = np.linalg.norm(atol + rtol * np.abs(target)) / sigma_min if sigma_min > 0 else np.inf
+    if not eps < 1:
+        return np.inf
+
+    return max(floor, -len(target) * np.log1p(-eps))
+
+
+def CanReach(reach, remaining, needed, tol=1e-6):
+    """
+    Checks if the missing log|det| can be made up by the remaining remedies.
+    :param reach: Output of 'ReachableLogDets' or 'ReachableUpTo'
+    :param remaining: Number of remedies still to be applied after the children
+    :param needed: Missing log|det| values, array
+    :param tol: Tolerance of the comparison
+    :return: Boolean array
+    """
+
+    sums = reach[remaining]
+    if isinstance(sums, tuple):
+        return (needed >= sums[0] - tol) & (needed <= sums[1] + tol)
+
+    idx = np.searchsorted(sums, needed - tol)
+    return (idx < len(sums)) & (sums[np.minimum(idx, len(sums) - 1)] <= needed + tol)
+
+
+def MatchTarget(children, target, trace_target, trace_tol):
+    """
+    Compares stacked products with the target. The cheap trace test comes first,
+    then the full comparison, both vectorized.
+    :param children: Stacked products, (M, n, n)
+    :param target: The target matrix
+    :param trace_target: Trace of the target
+    :param trace_tol: Tolerance of the trace comparison
+    :return: Indices of the products equal to the target
+    """
+
+    traces = np.trace(children, axis1=1, axis2=2)
+    close = np.abs(traces - trace_target) <= trace_tol
+    close[close] = np.all(np.isclose(children[close], target), axis=(1, 2))
+
+    return np.flatnonzero(close)
+
+
+def ExpandLevel(G, usable, log_dets, products, indices, log_products, repeat, keep):
+    """
+    Extends every sequence of a level by every usable remedy, with one stacked matrix product.
+    The new sequences are in the order of the brute force search (by prefix, then by the new remedy).
+    :param G: Stacked remedy matrices
+    :param usable: Mask of the remedies which can be used at all
+    :param log_dets: log|det| of the remedies
+    :param products: Products of the sequences of the level, (M, n, n)
+    :param indices: Remedy indices of the sequences, (M, length)
+    :param log_products: log|det| of the sequences, (M,)
+    :param repeat: If True, one remedy can be used more than once
+    :param keep: Function of the log|det| of the new sequences, giving the mask of the ones worth keeping
+    :return: The products, remedy indices and log|det| of the next level
+    """
+
+    candidates = np.flatnonzero(usable)
+    M, k = len(indices), len(candidates)
+
+    parent = np.repeat(np.arange(M), k)
+    remedy = np.tile(candidates, M)
+    log_children = log_products[parent] + log_dets[remedy]
+
+    mask = keep(log_children)
+    if not repeat:
+        mask &= ~np.any(indices[parent] == remedy[:, None], axis=1)
+
+    parent, remedy = parent[mask], remedy[mask]
+    children = G[remedy] @ products[parent]
+
+    return children, np.hstack([indices[parent], remedy[:, None]]), log_children[mask]
+
+
+def RemedyDFS(G, usable, log_dets, prefix, log_prefix, path, depth, repeat,
+              target, log_target, trace_target, trace_tol, reach, log_tol):
+    """
+    One step of the depth-first search for sequences of exactly the given length.
+    All children of a prefix are computed with a single stacked matrix product.
+    :param G: Stacked remedy matrices
+    :param usable: Mask of the remedies which can be used at all
+    :param log_dets: log|det| of the remedies
+    :param prefix: Product of the remedies applied so far
+    :param log_prefix: log|det| of the prefix
+    :param path: Indices of the remedies applied so far
+    :param depth: Length of the searched sequences
+    :param repeat: If True, one remedy can be used more than once
+    :param target: The target matrix
+    :param log_target: log|det| of the target
+    :param trace_target: Trace of the target
+    :param trace_tol: Tolerance of the trace comparison
+    :param reach: Output of 'ReachableLogDets', None turns off the pruning
+    :param log_tol: Tolerance of the log|det| pruning, see 'LogDetTolerance'
+    :return: List of remedy indices, or None
+    """
+
+    candidates = usable.copy()
+    if not repeat:
+        candidates[path] = False
+    candidates = np.flatnonzero(candidates)
+
+    remaining = depth - len(path) - 1
+    log_children = log_prefix + log_dets[candidates]
+
+    if reach is not None:
+        keep = CanReach(reach, remaining, log_target - log_children, log_tol)
+        candidates = candidates[keep]
+        log_children = log_children[keep]
+
+    if len(candidates) == 0:
+        return None
+
+    children = G[candidates] @ prefix
+
+    if remaining == 0:
+        hits = MatchTarget(children, target, trace_target, trace_tol)
+        return path + [candidates[hits[0]]] if len(hits) else None
+
+    for child, log_child, i in zip(children, log_children, candidates):
+        sequence = RemedyDFS(G, usable, log_dets, child, log_child, path + [i], depth, repeat,
+                             target, log_target, trace_target, trace_tol, reach, log_tol)
+        if sequence is not None:
+            return sequence
+
+    return None
+
+
+def SequenceProducts(G, length, repeat):
+    """
+    Computes the products of every remedy sequence of the given length, level by level,
+    with one stacked matrix product per level.
+    :param G: Stacked remedy matrices
+    :param length: Length of the sequences
+    :param repeat: If True, one remedy can be used more than once
+    :return: The products (M, n, n) and the remedy indices of the sequences (M, length)
+    """
+
+    size = G.shape[-1]
+    products = np.eye(size)[None]
+    indices = np.zeros((1, 0), dtype=int)
+
+    for _ in range(length):
+        # The newest remedy is applied from the left
+        products = (G[None, :] @ products[:, None]).reshape(-1, size, size)
+        indices = np.hstack([np.repeat(indices, len(G), axis=0),
+                             np.tile(np.arange(len(G)), len(indices))[:, None]])
+
+        if not repeat:
+            distinct = ~np.any(indices[:, :-1] == indices[:, -1:], axis=1)
+            products = products[distinct]
+            indices = indices[distinct]
+
+    return products, indices
+
+
+def RemedyMITM(G, depth, repeat, target, seed=0):
+    """
+    Meet-in-the-middle search for sequences of exactly the given length.
+    For S @ F = target, the first half F has to be equal to inverse(S) @ target.
+    The products of the first half are keyed by a random linear projection and sorted,
+    so the matching candidates of every second half are found by binary search,
+    and only these are checked with the full comparison.
+    :param G: Stacked remedy matrices
+    :param depth: Length of the searched sequences
+    :param repeat: If True, one remedy can be used more than once
+    :param target: The target matrix
+    :param seed: Seed of the random projection
+    :return: List of remedy indices, or None
+    """
+
+    left, left_idx = SequenceProducts(G, depth // 2, repeat)
+    right, right_idx = SequenceProducts(G, depth - depth // 2, repeat)
+
+    # Singular second halves can not be inverted
+    regular = np.abs(np.linalg.det(right)) > 1e-12
+    right, right_idx = right[regular], right_idx[regular]
+    wanted = np.linalg.solve(right, np.broadcast_to(target, right.shape))
+
+    weights = np.random.default_rng(seed).standard_normal(target.shape)
+
+    left_keys = np.einsum("mij,ij->m", left, weights)
+    order = np.argsort(left_keys)
+    left_keys = left_keys[order]
+
+    right_keys = np.einsum("mij,ij->m", wanted, weights)
+    tol = 1e-6 * np.einsum("mij,ij->m", 1 + np.abs(wanted), np.abs(weights))
+
+    low = np.searchsorted(left_keys, right_keys - tol, side="left")
+    high = np.searchsorted(left_keys, right_keys + tol, side="right")
+
+    for r in np.flatnonzero(high > low):
+        for l in order[low[r]:high[r]]:
+            if not repeat and np.intersect1d(left_idx[l], right_idx[r]).size:
+                continue
+            if np.allclose(right[r] @ left[l], target):
+                return list(left_idx[l]) + list(right_idx[r])
+
+    return None
+
+
+def IterStates(CursedMatrix, remedies, sequence):
+    """
+    This function yields the states of B (Cursed Matrix) one by one,
     through back to A (Original stat matrix). Starting and ending in the two.
+    Two preallocated buffers are used in turn, so a yielded state is overwritten
+    two steps later, copy it if it has to be kept.
     :param CursedMatrix: Cursed stat matrix
     :param remedies: Dict of remedies
     :param sequence: The ordered list of correct keys
-    :return:
+    :return: Generator of the states
     """
 
-    B = CursedMatrix
-    states = [B]
+    dtype = np.result_type(CursedMatrix, *(remedies[k] for k in sequence))
+
+    current = np.array(CursedMatrix, dtype=dtype)
+    spare = np.empty_like(current)
+
+    yield current
 
     for k in sequence:
-        B = remedies[k] @ B
-        states.append(B)
+        np.matmul(remedies[k], current, out=spare)
+        current, spare = spare, current
+        yield current
+
+
+def MakeStates(CursedMatrix, remedies, sequence):
+    """
+    This function makes a list from all the states of B (Cursed Matrix)
+    through back to A (Original stat matrix). Starting and ending in the two.
+    :param CursedMatrix: Cursed stat matrix
+    :param remedies: Dict of remedies
+    :param sequence: The ordered list of correct keys
+    :return: List of the states
+    """
 
-    return states
+    return [state.copy() for state in IterStates(CursedMatrix, remedies, sequence)]
 
 # -------------------------------------------------------
 # Plotting functions
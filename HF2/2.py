@@ -1,6 +1,15 @@
+import os
+import hashlib
+import contextlib
+import multiprocessing
+import concurrent.futures as cf
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
+import scipy.linalg as sla
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy.optimize import linear_sum_assignment
 
 
 # -------------------------------------------------------
@@ -9,6 +18,10 @@ import matplotlib as mpl
 
 N = 80
 T1 = 1
+# Next to this file, so it does not depend on the directory the script is started from
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".spectrum_cache")
+# Part of the cache key, increase it whenever 'eigenvalues' changes, so old spectra are not served
+EIGEN_VERSION = 1
 
 
 # -------------------------------------------------------
@@ -52,39 +65,236 @@ def build_matrix(N, t1, t2, g, eta):
     return H
 
 
+def build_bands(N, t1, t2, g, eta):
+    """
+    Makes the non-zero diagonals of the same matrix as 'build_matrix', without the matrix itself.
+    The periodic corner terms are diagonals too, at the offsets ±(N - 1) and ±(N - 2).
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g: Non-Hermiticity parameter
+    :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :return: Dict of {offset: diagonal array}
+    """
+
+    terms = [(1, t1 * np.exp(g)), (-1, t1 * np.exp(-g)),
+             (2, t2 * np.exp(2 * g)), (-2, t2 * np.exp(-2 * g))]
+
+    if eta != 0:
+        terms += [(-(N - 1), eta * t1 * np.exp(g)), (N - 1, eta * t1 * np.exp(-g)),
+                  (-(N - 2), eta * t2 * np.exp(2 * g)), (N - 2, eta * t2 * np.exp(-2 * g))]
+
+    # For small N some offsets coincide, these are added up, like the '+=' in 'build_matrix'
+    bands = {}
+    for offset, value in terms:
+        length = N - abs(offset)
+        if length <= 0:
+            continue
+        bands[offset] = bands.get(offset, np.zeros(length)) + value
+
+    return bands
+
+
+def build_sparse_matrix(N, t1, t2, g, eta, fmt="csr"):
+    """
+    Makes the same matrix as 'build_matrix', but as a scipy sparse matrix,
+    so it only needs O(N) memory.
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g: Non-Hermiticity parameter
+    :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :param fmt: Sparse format, for example "csr" or "dia"
+    :return: The sparse H matrix
+    """
+
+    bands = build_bands(N, t1, t2, g, eta)
+
+    return sp.diags(list(bands.values()), list(bands.keys()), shape=(N, N), format=fmt, dtype=float)
+
+
 # -------------------------------------------------------
 # Helper Functions
 # -------------------------------------------------------
 
 
-def eigenvalues(N, t1, t2, g, eta):
+def bloch_eigenvalues(N, t1, t2, g):
+    """
+    With eta = 1 the matrix is circulant, so its eigenvalues are given by the
+    Bloch formula over the N allowed k = 2 pi m / N values, in O(N) time.
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g: Non-Hermiticity parameter
+    :return: Array of the eigen values of H
+    """
+
+    k = 2 * np.pi * np.arange(N) / N
+
+    return (t1 * np.exp(g) * np.exp(1j * k) + t1 * np.exp(-g) * np.exp(-1j * k) +
+            t2 * np.exp(2 * g) * np.exp(2j * k) + t2 * np.exp(-2 * g) * np.exp(-2j * k))
+
+
+def open_eigen(N, t1, t2, g, eigvals_only=True, select=None):
+    """
+    With eta = 0 the matrix is similar to the Hermitian g = 0 matrix: H = D H0 D^-1,
+    with D = diag(exp(-g n)). So the spectrum is real and does not depend on g,
+    and it can be calculated with the symmetric banded solver.
+    The eigenvectors are mapped back as psi_n = exp(-g n) u_n, in logarithmic form,
+    so that large g * N does not overflow.
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g: Non-Hermiticity parameter
+    :param eigvals_only: If False, the normalized eigenvectors are calculated too
+    :param select: Index range (first, last) of the requested eigenvalues, by default all
+    :return: Array of the eigen values, and the eigenvectors in the columns, if requested
+    """
+
+    # Upper banded form: row 0 is the second, row 1 the first superdiagonal, row 2 the diagonal
+    band = np.zeros((3, N))
+    band[0, 2:] = t2
+    band[1, 1:] = t1
+
+    vals = sla.eig_banded(band, eigvals_only=True)
+
+    if select is not None:
+        vals = vals[select[0]:select[1] + 1]
+
+    if eigvals_only:
+        return vals
+
+    # A few selected eigenvectors are much cheaper by inverse iteration
+    if select is None:
+        vals, u = sla.eig_banded(band)
+    else:
+        u = np.column_stack([InverseIteration(band, val) for val in vals])
+
+    with np.errstate(divide='ignore'):
+        log_psi = -g * np.arange(N)[:, None] + np.log(np.abs(u))
+    psi = np.sign(u) * np.exp(log_psi - np.max(log_psi, axis=0))
+    psi /= np.linalg.norm(psi, axis=0)
+
+    return vals, psi
+
+
+def InverseIteration(band, val, steps=3):
+    """
+    Finds the eigenvector of a symmetric banded matrix belonging to a known eigenvalue,
+    with a few steps of inverse iteration, each one is a banded solve in O(N) time.
+    :param band: The matrix in upper banded form, as for 'scipy.linalg.eig_banded'
+    :param val: The eigenvalue
+    :param steps: Number of iterations
+    :return: The normalized eigenvector
+    """
+
+    u, N = band.shape[0] - 1, band.shape[1]
+
+    # The shift is moved off the eigenvalue a little, so the system is not exactly singular
+    shift = val + 1e-10 * max(abs(val), 1)
+
+    # General banded form of (H0 - shift I), for 'scipy.linalg.solve_banded'
+    ab = np.zeros((2 * u + 1, N))
+    ab[:u + 1] = band
+    ab[u] -= shift
+    for i in range(1, u + 1):
+        ab[u + i, :-i] = band[u - i, i:]
+
+    x = np.random.default_rng(0).standard_normal(N)
+    for _ in range(steps):
+        x = sla.solve_banded((u, u), ab, x)
+        x /= np.linalg.norm(x)
+
+    return x
+
+
+def eigenvalues(N, t1, t2, g, eta, H=None, k=None):
     """
     Calculates the eigen values of an H matrix defined by the list of
     parameters below, and created by 'build_matrix' function.
+    For eta = 1 the analytic Bloch spectrum is used instead of diagonalization,
+    for eta = 0 the similar Hermitian matrix is diagonalized (see 'open_eigen').
     :param N: Size of the matrix
     :param t1: First-neighbour hopping amplitude
     :param t2: Second-neighbour hopping amplitude
     :param g: Non-Hermiticity parameter
     :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :param H: Already built (dense or sparse) matrix, then the parameters above are not used
+    :param k: Only the k eigenvalues with the largest magnitude are calculated from a sparse matrix.
+        It is required for a sparse H, as a sparse H is never made dense, and without H
+        the sparse matrix is built (see 'build_sparse_matrix'). A dense H does not accept it.
     :return: Array of the eigen values of H
     """
 
-    H = build_matrix(N, t1, t2, g, eta)
+    if H is None:
+        if k is not None:
+            H = build_sparse_matrix(N, t1, t2, g, eta)
+        elif eta == 1:
+            return bloch_eigenvalues(N, t1, t2, g)
+        elif eta == 0:
+            return open_eigen(N, t1, t2, g)
+        else:
+            H = build_matrix(N, t1, t2, g, eta)
+
+    if sp.issparse(H):
+        if k is None:
+            raise ValueError("A sparse H needs k, the number of eigenvalues to calculate.")
+        return spla.eigs(H, k=k, which='LM', return_eigenvectors=False)
+
+    if k is not None:
+        raise ValueError("k can only be used with a sparse H.")
+
     return np.linalg.eigvals(H)
 
 
-def eigenvector_max_imag(N, t1, t2, g, eta):
+def eigenvector_max_imag(N, t1, t2, g, eta, H=None, sparse=False, sigma=None):
     """
     This function is for the last plot. This finds the biggest eigenvalue, and it's eigen vector
+    With 'sparse' only this one eigenpair is calculated by ARPACK, on the sparse matrix,
+    and with 'sigma' the eigenpair closest to sigma is found with shift-invert.
+    For eta = 1 the target of the shift-invert is known from the Bloch spectrum,
+    otherwise ARPACK looks for the largest imaginary (or real) part directly,
+    which converges slowly for large, strongly non-normal matrices.
     :param N: Size of the matrix
     :param t1: First-neighbour hopping amplitude
     :param t2: Second-neighbour hopping amplitude
     :param g: Non-Hermiticity parameter
     :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :param H: Already built (dense or sparse) matrix, then the parameters above are not used
+    :param sparse: If True, the full diagonalization is replaced by 'scipy.sparse.linalg.eigs',
+        this is always the case for a sparse H
+    :param sigma: Target eigenvalue for shift-invert, implies 'sparse'
     :return: The biggest eigenvalue, the list of psi eigenvectors attached to it
     """
 
-    H = build_matrix(N, t1, t2, g, eta)
+    # With open boundaries every eigenvalue is real, the biggest one is needed
+    if H is None and eta == 0 and sigma is None:
+        vals, vecs = open_eigen(N, t1, t2, g, eigvals_only=False, select=(N - 1, N - 1))
+        return vals[0], vecs[:, 0]
+
+    if sparse or sigma is not None or sp.issparse(H):
+        if sigma is None and H is None and eta == 1:
+            bloch = bloch_eigenvalues(N, t1, t2, g)
+            sigma = bloch[np.argmax(bloch.imag)] * (1 + 1e-9)
+
+        if H is None:
+            H = build_sparse_matrix(N, t1, t2, g, eta)
+
+        # Complex shifts need a complex matrix in 'eigs'
+        H = sp.csc_matrix(H).astype(complex)
+
+        if sigma is not None:
+            vals, vecs = spla.eigs(H, k=1, sigma=sigma)
+        else:
+            vals, vecs = spla.eigs(H, k=1, which='LI')
+            if np.abs(vals[0].imag) < 1e-10:
+                vals, vecs = spla.eigs(H, k=1, which='LR')
+
+        return vals[0], vecs[:, 0] / np.linalg.norm(vecs[:, 0])
+
+    if H is None:
+        H = build_matrix(N, t1, t2, g, eta)
+
     vals, vecs = np.linalg.eig(H)
 
     if np.all(np.abs(vals.imag) < 1e-10):
@@ -101,7 +311,125 @@ def eigenvector_max_imag(N, t1, t2, g, eta):
     return lamda, psi
 
 
-def spectral_widths(N, t1, t2, g_array, eta):
+def localization_metrics(vecs, edge=1):
+    """
+    Computes localization measures of many eigenvectors at once.
+    The inverse participation ratio is 1 for a vector on a single site and 1/N for a uniform one.
+    :param vecs: Eigenvectors in the columns, (N, M), or a single eigenvector
+    :param edge: Number of sites counted as the edge, at each end of the chain
+    :return: IPR (M,), weight on the left edge (M,), weight on the right edge (M,)
+    """
+
+    weights = np.abs(np.asarray(vecs)) ** 2
+    if weights.ndim == 1:
+        weights = weights[:, None]
+    weights = weights / np.sum(weights, axis=0)
+
+    ipr = np.sum(weights ** 2, axis=0)
+    left = np.sum(weights[:edge], axis=0)
+    right = np.sum(weights[-edge:], axis=0)
+
+    return ipr, left, right
+
+
+def CheckBloch(N, t1, t2, g):
+    """
+    Checks if the analytic Bloch spectrum agrees with the diagonalization of the dense matrix.
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g: Non-Hermiticity parameter
+    :return: The Bloch eigenvalues
+    """
+
+    bloch = bloch_eigenvalues(N, t1, t2, g)
+    dense = np.linalg.eigvals(build_matrix(N, t1, t2, g, eta=1))
+
+    # Every eigenvalue has to have a pair in the other spectrum
+    distance = np.abs(bloch[:, None] - dense[None, :])
+    scale = max(np.abs(dense).max(), 1)
+
+    if np.all(distance.min(axis=0) < 1e-8 * scale) and np.all(distance.min(axis=1) < 1e-8 * scale):
+        return bloch
+    else:
+        raise ValueError("The Bloch spectrum doesn't match with the dense diagonalization.")
+
+
+def cached_eigenvalues(N, t1, t2, g, eta, cache_dir=CACHE_DIR):
+    """
+    Same as 'eigenvalues', but the results are kept on disk, keyed by (N, t1, t2, g, eta),
+    the method 'eigenvalues' uses for them and EIGEN_VERSION, so they are not recalculated in later sessions.
+    For eta = 0 and 1 the fast paths are hardly slower than reading the file, the cache pays off for the others.
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g: Non-Hermiticity parameter
+    :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :param cache_dir: Directory of the cache files
+    :return: Array of the eigen values of H
+    """
+
+    method = {0: "open_eigen", 1: "bloch"}.get(eta, "eigvals")
+    key = repr((int(N), float(t1), float(t2), float(g), float(eta), method, EIGEN_VERSION))
+    path = os.path.join(cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    if os.path.exists(path):
+        return np.load(path)
+
+    eigs = eigenvalues(N, t1, t2, g, eta)
+
+    # Written under a temporary name first, so a half written file is never read
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as file:
+        np.save(file, eigs)
+    os.replace(tmp, path)
+
+    return eigs
+
+
+def TrackBranches(spectra):
+    """
+    Orders the eigenvalues of consecutive steps, so that every column follows one branch.
+    The eigenvalues are matched one-to-one to the nearest predicted position,
+    which is the linear extrapolation of the last two steps.
+    :param spectra: List of eigenvalue arrays of the same length
+    :return: Array of shape (steps, N), one branch per column
+    """
+
+    tracked = np.empty((len(spectra), len(spectra[0])), dtype=complex)
+    tracked[0] = spectra[0]
+
+    for i in range(1, len(spectra)):
+        predicted = tracked[i - 1] if i == 1 else 2 * tracked[i - 1] - tracked[i - 2]
+        distance = np.abs(predicted[:, None] - np.asarray(spectra[i])[None, :])
+        _, cols = linear_sum_assignment(distance)
+        tracked[i] = np.asarray(spectra[i])[cols]
+
+    return tracked
+
+
+def spectral_flow(N, t1, t2, g_array, eta, cache_dir=CACHE_DIR):
+    """
+    Calculates the spectrum for every g, with the on-disk cache, and follows the eigenvalue branches.
+    :param N: Size of the matrix
+    :param t1: First-neighbour hopping amplitude
+    :param t2: Second-neighbour hopping amplitude
+    :param g_array: Array of g values
+    :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :param cache_dir: Directory of the cache files, None turns off the cache
+    :return: Array of shape (len(g_array), N), one branch per column
+    """
+
+    if cache_dir is None:
+        spectra = [eigenvalues(N, t1, t2, g, eta) for g in g_array]
+    else:
+        spectra = [cached_eigenvalues(N, t1, t2, g, eta, cache_dir) for g in g_array]
+
+    return TrackBranches(spectra)
+
+
+def spectral_widths(N, t1, t2, g_array, eta, cache_dir=None):
     """
     Computes real and imaginary spectral widths W_Re and W_Im for each g value.
     :param N: Size of the matrix
@@ -109,6 +437,7 @@ def spectral_widths(N, t1, t2, g_array, eta):
     :param t2: Second-neighbour hopping amplitude
     :param g: Non-Hermiticity parameter
     :param eta: Boundary condition parameter (0 = open, 1 = periodic)
+    :param cache_dir: Directory of the eigenvalue cache, None turns off the cache
     :return: Width of real component (W_Re, array), width of imaginary component (W_Im, array)
     """
 
@@ -116,13 +445,129 @@ def spectral_widths(N, t1, t2, g_array, eta):
     W_Im = np.empty(len(g_array))
 
     for i, g in enumerate(g_array):
-        eigs = eigenvalues(N, t1, t2, g, eta)
+        if cache_dir is None:
+            eigs = eigenvalues(N, t1, t2, g, eta)
+        else:
+            eigs = cached_eigenvalues(N, t1, t2, g, eta, cache_dir)
         W_Re[i] = np.max(eigs.real) - np.min(eigs.real)
         W_Im[i] = np.max(eigs.imag) - np.min(eigs.imag)
 
     return W_Re, W_Im
 
 
+# -------------------------------------------------------
+# Sweep Functions
+# -------------------------------------------------------
+
+
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS",
+                    "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+@contextlib.contextmanager
+def SingleThreadBLAS():
+    """
+    Limits BLAS to one thread in the worker processes started inside the block.
+    The workers are spawned fresh, so they read these variables when importing numpy.
+    """
+
+    saved = {var: os.environ.get(var) for var in BLAS_THREAD_VARS}
+    os.environ.update({var: "1" for var in BLAS_THREAD_VARS})
+
+    try:
+        yield
+    finally:
+        for var, value in saved.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+
+
+def SweepChunk(points, t1):
+    """
+    Computes the spectral widths for a chunk of grid points, in a worker process.
+    :param points: Array of (g, t2, eta, N) rows
+    :param t1: First-neighbour hopping amplitude
+    :return: W_Re and W_Im arrays of the chunk
+    """
+
+    W_Re = np.empty(len(points))
+    W_Im = np.empty(len(points))
+
+    for i, (g, t2, eta, N) in enumerate(points):
+        eigs = eigenvalues(int(N), t1, t2, g, eta)
+        W_Re[i] = np.max(eigs.real) - np.min(eigs.real)
+        W_Im[i] = np.max(eigs.imag) - np.min(eigs.imag)
+
+    return W_Re, W_Im
+
+
+def SaveSweep(filename, axes, W_Re, W_Im, done):
+    """
+    Writes the current state of the sweep. The file is replaced in one step,
+    so an interrupted run always leaves a readable file behind.
+    :param filename: Name of the .npz file
+    :param axes: Dict of the grid axes
+    :param W_Re: Width of real component, on the grid
+    :param W_Im: Width of imaginary component, on the grid
+    :param done: Mask of the computed grid points
+    """
+
+    tmp = filename + ".tmp.npz"
+    np.savez(tmp, W_Re=W_Re, W_Im=W_Im, done=done, **axes)
+    os.replace(tmp, filename)
+
+
+def sweep(g_array, t2_array, eta_array, N_array, t1=T1, filename="sweep.npz",
+          workers=None, chunk=16):
+    """
+    Computes the spectral widths over the whole (g, t2, eta, N) grid on a process pool.
+    Every finished chunk is written to 'filename', and an existing file with the same
+    grid is continued, so an interrupted sweep can be resumed.
+    :param g_array: Array of g values
+    :param t2_array: Array of t2 values
+    :param eta_array: Array of eta values
+    :param N_array: Array of matrix sizes
+    :param t1: First-neighbour hopping amplitude
+    :param filename: Name of the .npz output file
+    :param workers: Number of worker processes, by default the number of CPUs
+    :param chunk: Number of grid points per task
+    :return: W_Re and W_Im, with shape (len(g), len(t2), len(eta), len(N))
+    """
+
+    axes = dict(g=np.asarray(g_array, dtype=float), t2=np.asarray(t2_array, dtype=float),
+                eta=np.asarray(eta_array, dtype=float), N=np.asarray(N_array, dtype=int))
+    shape = tuple(len(axis) for axis in axes.values())
+
+    W_Re = np.full(shape, np.nan)
+    W_Im = np.full(shape, np.nan)
+    done = np.zeros(shape, dtype=bool)
+
+    # Resume, if the same grid was already (partly) computed
+    if os.path.exists(filename):
+        with np.load(filename) as old:
+            if all(np.array_equal(old[name], axis) for name, axis in axes.items()):
+                W_Re, W_Im, done = old["W_Re"], old["W_Im"], old["done"]
+
+    grid = np.stack(np.meshgrid(*axes.values(), indexing='ij'), axis=-1).reshape(-1, 4)
+    todo = np.flatnonzero(~done.ravel())
+    chunks = [todo[i:i + chunk] for i in range(0, len(todo), chunk)]
+
+    context = multiprocessing.get_context("spawn")
+
+    with SingleThreadBLAS(), cf.ProcessPoolExecutor(workers, mp_context=context) as pool:
+        futures = {pool.submit(SweepChunk, grid[idx], t1): idx for idx in chunks}
+
+        for future in cf.as_completed(futures):
+            idx = futures[future]
+            W_Re.flat[idx], W_Im.flat[idx] = future.result()
+            done.flat[idx] = True
+            SaveSweep(filename, axes, W_Re, W_Im, done)
+
+    return W_Re, W_Im
+
+
 # -------------------------------------------------------
 # Plotting Functions
 # -------------------------------------------------------
@@ -277,6 +722,9 @@ def main():
 
     SetTex()
 
+    # The periodic spectra come from the Bloch formula, check it against the dense path
+    CheckBloch(N, T1, t2=0.3, g=0.4)
+
     # --- Task 1: Spectrum vs eta ---
     eta_list = [1e-14, 1e-10, 1e-7, 1e-3, 1]
     eta_list2 = [0.0, 0.25, 0.5, 0.75, 1.0]
@@ -1,8 +1,22 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
+import os
 import time
+import sys
+import csv
+import json
+import tracemalloc
+import multiprocessing
+import concurrent.futures as cf
 import scipy.sparse as scisp
+from math import comb
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, then the peak RSS is not recorded
+    resource = None
 
 
 # -------------------------------------------
@@ -39,56 +53,328 @@ def nDimenziosKocka(N: int) -> scisp.csr_matrix:
     return M_N
 
 
+def nDimenziosKockaBit(N: int) -> scisp.csr_matrix:
+    """
+    This function creates the same adjacency matrix as 'nDimenziosKocka',
+    but directly, without the recursion. The neighbours of a vertex differ
+    in exactly one bit, so the column indices are 'row ^ (1 << d)', and every
+    row has exactly N of them. The whole index array is made in one NumPy expression.
+    :param N: Number of dimensions
+    :return: Sparce adjacency matrix
+    """
+
+    size = 1 << N
+
+    # int32 halves the index memory, but N * 2^N overflows it from N = 27 on
+    index_dtype = np.int32 if size * N <= np.iinfo(np.int32).max else np.int64
+
+    rows = np.arange(size, dtype=index_dtype)
+    bits = np.left_shift(index_dtype(1), np.arange(N, dtype=index_dtype))
+
+    # Sorted within the rows, as in a canonical CSR matrix
+    indices = np.sort(rows[:, None] ^ bits[None, :], axis=1).ravel()
+    indptr = np.arange(size + 1, dtype=index_dtype) * N
+    data = np.ones(size * N, dtype=np.int8)
+
+    return scisp.csr_matrix((data, indices, indptr), shape=(size, size))
+
+
+def HypercubeOperator(N: int) -> scisp.linalg.LinearOperator:
+    """
+    This function creates the adjacency of an N dimensional cube as a matrix-free
+    operator, so only O(2^N) memory is needed. A vector is viewed as a (2,)*N array,
+    and flipping it along one binary axis swaps the vertices that differ in that bit.
+    The product is the sum of the N flips.
+    :param N: Number of dimensions
+    :return: Linear operator of the adjacency matrix
+    """
+
+    size = 1 << N
+
+    def matmat(X):
+        X = np.asarray(X)
+        cols = X.shape[1]
+        X = X.reshape((2,) * N + (cols,))
+
+        Y = np.zeros(X.shape, dtype=np.result_type(X.dtype, np.float64))
+        for axis in range(N):
+            Y += np.flip(X, axis=axis)
+
+        return Y.reshape(size, cols)
+
+    def matvec(x):
+        return matmat(np.reshape(x, (size, 1))).ravel()
+
+    # The adjacency matrix is symmetric
+    return scisp.linalg.LinearOperator((size, size), matvec=matvec, rmatvec=matvec,
+                                       matmat=matmat, rmatmat=matmat, dtype=np.float64)
+
+
+def fwht(x: np.ndarray) -> np.ndarray:
+    """
+    Fast (unnormalized) Walsh-Hadamard transform of a vector of length 2^N, in O(N * 2^N).
+    The rows of the Hadamard matrix are the eigenvectors of the N dimensional cube.
+    :param x: Input vector
+    :return: Transformed vector
+    """
+
+    y = np.array(x, dtype=np.float64)
+    size = len(y)
+
+    h = 1
+    while h < size:
+        # In-place butterflies between the pairs that differ in one bit
+        pairs = y.reshape(-1, 2, h)
+        first = pairs[:, 0].copy()
+        pairs[:, 0] += pairs[:, 1]
+        np.subtract(first, pairs[:, 1], out=pairs[:, 1])
+        h *= 2
+
+    return y
+
+
+def hypercube_spectrum(N: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gives the exact spectrum of an N dimensional cube. The eigenvector of the
+    Hadamard row k has the eigenvalue N - 2 * popcount(k), so the eigenvalue
+    N - 2j appears binom(N, j) times.
+    :param N: Number of dimensions
+    :return: Ascending array of the distinct eigenvalues, array of their multiplicities
+    """
+
+    j = np.arange(N, -1, -1)
+    return N - 2 * j, np.array([comb(N, int(i)) for i in j])
+
+
+def hadamard_eigenvector(N: int, k: int) -> np.ndarray:
+    """
+    Gives the normalized eigenvector of the Hadamard row k, which belongs
+    to the eigenvalue N - 2 * popcount(k), with one transform of a unit vector.
+    :param N: Number of dimensions
+    :param k: Index of the Hadamard row
+    :return: The eigenvector
+    """
+
+    e = np.zeros(1 << N)
+    e[k] = 1
+
+    return fwht(e) / np.sqrt(1 << N)
+
+
+# -------------------------------------------
+# Cartesian Product Graphs
+# -------------------------------------------
+# The cube is the Cartesian product of N copies of K2, and its adjacency matrix
+# is the Kronecker sum of the factors. The same holds for grids (paths),
+# tori (cycles) and Hamming graphs (complete graphs), and the spectrum of the
+# product is every sum of one eigenvalue from each factor.
+
+
+def path_graph(n: int) -> scisp.csr_matrix:
+    """
+    Adjacency matrix of a path on n vertices.
+    :param n: Number of vertices
+    :return: Sparse adjacency matrix
+    """
+
+    return scisp.diags([np.ones(n - 1), np.ones(n - 1)], [-1, 1], format='csr')
+
+
+def cycle_graph(n: int) -> scisp.csr_matrix:
+    """
+    Adjacency matrix of a cycle on n vertices (n >= 3).
+    :param n: Number of vertices
+    :return: Sparse adjacency matrix
+    """
+
+    M = path_graph(n).tolil()
+    M[0, n - 1] = M[n - 1, 0] = 1
+    return M.tocsr()
+
+
+def complete_graph(n: int) -> scisp.csr_matrix:
+    """
+    Adjacency matrix of the complete graph on n vertices.
+    :param n: Number of vertices
+    :return: Sparse adjacency matrix
+    """
+
+    return scisp.csr_matrix(np.ones((n, n)) - np.eye(n))
+
+
+def kron_sum_matrix(factors: list) -> scisp.csr_matrix:
+    """
+    Builds the adjacency matrix of the Cartesian product explicitly,
+    as sum_i I x ... x A_i x ... x I. Only for small products.
+    :param factors: List of factor adjacency matrices
+    :return: Sparse adjacency matrix of the product
+    """
+
+    sizes = [M.shape[0] for M in factors]
+    total = int(np.prod(sizes))
+    M = scisp.csr_matrix((total, total))
+
+    for i, A in enumerate(factors):
+        left = scisp.identity(int(np.prod(sizes[:i])), format='csr')
+        right = scisp.identity(int(np.prod(sizes[i + 1:])), format='csr')
+        M = M + scisp.kron(scisp.kron(left, A), right, format='csr')
+
+    return M
+
+
+def kron_sum_operator(factors: list) -> scisp.linalg.LinearOperator:
+    """
+    Makes the adjacency of the Cartesian product as a matrix-free operator.
+    A vector is viewed as an array with one axis per factor, and each factor
+    acts along its own axis, so the product matrix is never built.
+    :param factors: List of factor adjacency matrices
+    :return: Linear operator of the product adjacency matrix
+    """
+
+    sizes = [M.shape[0] for M in factors]
+    total = int(np.prod(sizes))
+    dense = [np.asarray(M.todense()) if scisp.issparse(M) else np.asarray(M) for M in factors]
+
+    def matmat(X):
+        X = np.asarray(X)
+        cols = X.shape[1]
+        X = X.reshape(sizes + [cols])
+
+        Y = np.zeros(X.shape, dtype=np.result_type(X.dtype, np.float64))
+        for axis, A in enumerate(dense):
+            # A acts on 'axis', tensordot puts the new axis first, so it is moved back
+            Y += np.moveaxis(np.tensordot(A, X, axes=(1, axis)), 0, axis)
+
+        return Y.reshape(total, cols)
+
+    def matvec(x):
+        return matmat(np.reshape(x, (total, 1))).ravel()
+
+    # Undirected graphs, so the matrix is symmetric
+    return scisp.linalg.LinearOperator((total, total), matvec=matvec, rmatvec=matvec,
+                                       matmat=matmat, rmatmat=matmat, dtype=np.float64)
+
+
+def factor_eigen(factors: list) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    Diagonalizes the (small) factors densely.
+    :param factors: List of factor adjacency matrices
+    :return: List of (ascending eigenvalues, eigenvectors in the columns) per factor
+    """
+
+    return [np.linalg.eigh(M.toarray() if scisp.issparse(M) else np.asarray(M)) for M in factors]
+
+
+def product_eigenvalues(eigens: list, k: int = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Gives the smallest eigenvalues of the product from the factor spectra.
+    The k smallest sums only use the k smallest values of every partial sum,
+    so the factors are added one by one and the rest is dropped each time.
+    :param eigens: Output of 'factor_eigen'
+    :param k: Number of smallest eigenvalues, by default all of them
+    :return: Ascending eigenvalues, and the factor eigenvalue indices belonging to them (one row each)
+    """
+
+    values = np.zeros(1)
+    indices = np.zeros((1, 0), dtype=np.int64)
+
+    for vals, _ in eigens:
+        sums = np.add.outer(values, vals).ravel()
+        order = np.argsort(sums, kind='stable')
+        if k is not None:
+            order = order[:k]
+
+        rows, cols = np.divmod(order, len(vals))
+        values = sums[order]
+        indices = np.hstack([indices[rows], cols[:, None]])
+
+    return values, indices
+
+
+def product_eigenvector(eigens: list, index) -> np.ndarray:
+    """
+    Gives an eigenvector of the product, as the Kronecker product of factor eigenvectors.
+    :param eigens: Output of 'factor_eigen'
+    :param index: Factor eigenvalue indices, a row of the output of 'product_eigenvalues'
+    :return: The normalized eigenvector
+    """
+
+    vec = np.ones(1)
+    for (_, vecs), i in zip(eigens, index):
+        vec = np.kron(vec, vecs[:, i])
+
+    return vec
+
+
 # -------------------------------------------
 # Helper Functions
 # -------------------------------------------
 
 
-def smallest_eigenvalues(N: int, k: int = 10) -> np.ndarray:
+def smallest_eigenvalues(N: int, k: int = 10, matrix_free: bool = False, analytic: bool = False) -> np.ndarray:
     """
     Finds the Smallest Algebraic (SA) eigenvalues of an N
     dimensional cube's adjacency matrix, and sorts it. This
     is requested for checking if the formula works.
     :param N: Number of dimensions
     :param k: Number of smallest eigenvalues to compute
+    :param matrix_free: If True, 'HypercubeOperator' is used instead of the sparse matrix
+    :param analytic: If True, the exact eigenvalues are given, without any solver
     :return: Sorted array of the ('k' number of) smallest eigenvalues
     """
 
-    M = nDimenziosKocka(N)
+    if analytic:
+        values, multiplicities = hypercube_spectrum(N)
+        # Only as many distinct values are repeated, as needed for k
+        needed = np.searchsorted(np.cumsum(multiplicities), k) + 1
+        return np.repeat(values[:needed], multiplicities[:needed])[:k].astype(np.float64)
+
+    M = HypercubeOperator(N) if matrix_free else nDimenziosKockaBit(N)
     # Use 'SA' (smallest algebraic) for Hermitian solver.
     vals = scisp.linalg.eigsh(M, k=k, which='SA', return_eigenvectors=False)
     return np.sort(vals)
 
 
-def measure_generation_times(max_dim: int = 22) -> tuple[list[int], list[float]]:
+def measure_generation_times(max_dim: int = 22, generators: dict = None,
+                             repeats: int = 3) -> tuple[list[int], dict[str, list[float]]]:
     """
     This function measures the generation time of the
-    adjacency matrices up to 'max_dim' dimensions.
+    adjacency matrices up to 'max_dim' dimensions, with 'benchmark_generators'.
     :param max_dim: Maximum dimension to test
-    :return: List of dimensions, List of generation times
+    :param generators: Dict of {name: generator function}, by default both generators
+    :param repeats: Number of timed runs, the median of them is given back
+    :return: List of dimensions, Dict of {name: list of generation times}
     """
 
+    if generators is None:
+        generators = {"kron": nDimenziosKocka, "bit": nDimenziosKockaBit}
+
     dims = list(range(1, max_dim + 1))
-    times = []
+    records = benchmark_generators(generators, dims, repeats, memory=False)
 
-    for n in dims:
-        t0 = time.time()
-        nDimenziosKocka(n)
-        t1 = time.time()
-        times.append(t1 - t0)
+    times = {name: [] for name in generators}
+    for record in records:
+        times[record["generator"]].append(record["median_s"])
 
     return dims, times
 
 
-def extreme_eigenvectors(N: int):
+def extreme_eigenvectors(N: int, matrix_free: bool = False, analytic: bool = False):
     """
     This function finds the biggest and smallest eigenvalue
     and its eigenvector, for an N dimensional adjacency matrix.
     :param N: Dimensional of the adjacency matrix
+    :param matrix_free: If True, 'HypercubeOperator' is used instead of the sparse matrix
+    :param analytic: If True, the exact Hadamard eigenvectors are given, without any solver
     :return: Smallest eigenvalue, its eigenvector, Largest eigenvalue, its eigenvector
     """
 
-    M = nDimenziosKocka(N)
+    if analytic:
+        # Row 2^N - 1 (every bit set) belongs to -N, row 0 to N
+        return (float(-N), hadamard_eigenvector(N, (1 << N) - 1),
+                float(N), hadamard_eigenvector(N, 0))
+
+    M = HypercubeOperator(N) if matrix_free else nDimenziosKockaBit(N)
 
     # Smallest algebraic eigenvalue
     val_min, vec_min = scisp.linalg.eigsh(M, k=1, which='SA')
@@ -98,6 +384,235 @@ def extreme_eigenvectors(N: int):
     return val_min[0], vec_min[:, 0], val_max[0], vec_max[:, 0]
 
 
+def CheckHadamard(max_dim: int = 8, k: int = 10):
+    """
+    Compares the analytic spectrum with eigsh, and checks the
+    Hadamard eigenvectors on the sparse matrix, up to 'max_dim' dimensions.
+    :param max_dim: Maximum dimension to test
+    :param k: Number of smallest eigenvalues to compare
+    """
+
+    for n in range(2, max_dim + 1):
+        M = nDimenziosKockaBit(n)
+        kn = min(k, (1 << n) - 1)
+
+        # Dense solver for the small matrices, to get the multiplicities right
+        exact = smallest_eigenvalues(n, kn, analytic=True)
+        numeric = np.linalg.eigvalsh(M.toarray())[:kn]
+        if not np.allclose(exact, numeric):
+            raise ValueError(f"The analytic eigenvalues don't match in {n} dimensions.")
+
+        numeric = smallest_eigenvalues(n, 1)
+        if not np.allclose(exact[:1], numeric):
+            raise ValueError(f"The analytic eigenvalues don't match eigsh in {n} dimensions.")
+
+        for row in range(1 << n):
+            vec = hadamard_eigenvector(n, row)
+            val = n - 2 * bin(row).count("1")
+            if not np.allclose(M @ vec, val * vec):
+                raise ValueError(f"Hadamard row {row} is not an eigenvector in {n} dimensions.")
+
+
+# -------------------------------------------
+# Benchmark Functions
+# -------------------------------------------
+
+
+def TimeRuns(function, repeats: int) -> tuple[float, float]:
+    """
+    Runs a function several times, and measures it with 'perf_counter'.
+    :param function: Function without arguments
+    :param repeats: Number of runs
+    :return: Median and interquartile range of the run times
+    """
+
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - t0)
+
+    q1, median, q3 = np.percentile(times, [25, 50, 75])
+    return float(median), float(q3 - q1)
+
+
+def PeakMemory(function) -> float:
+    """
+    Measures the peak memory allocated by Python and NumPy during one run, with 'tracemalloc'.
+    :param function: Function without arguments
+    :return: Peak memory in MB
+    """
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return peak / 2**20
+
+
+def PeakRSS() -> float:
+    """
+    Gives the peak resident set size of the process so far.
+    On Linux it is read from /proc (VmHWM), as 'ru_maxrss' keeps the peak of the
+    parent process through the exec of a spawned worker.
+    :return: Peak RSS in MB, or nan if it is not available
+    """
+
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+
+    if resource is None:
+        return float("nan")
+
+    # Linux reports it in kB, macOS in bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def RSSRun(generator, n: int) -> float:
+    """
+    Runs the generator once, in a fresh worker process, see 'GeneratorRSS'.
+    :return: The growth of the peak RSS during the run, in MB
+    """
+
+    before = PeakRSS()
+    generator(n)
+    return PeakRSS() - before
+
+
+def GeneratorRSS(generator, n: int) -> float:
+    """
+    Measures the peak RSS of one generator run. 'ru_maxrss' is the high-water mark of the whole
+    process, so every run gets a new process, otherwise a large earlier run would hide the later ones.
+    The growth over the RSS of the freshly started worker is given back, so the imports are not counted.
+    :param generator: The function that creates the adjacency matrix (a module level function)
+    :param n: Dimension
+    :return: Peak RSS growth in MB, or nan if it is not available
+    """
+
+    if resource is None and not os.path.exists("/proc/self/status"):
+        return float("nan")
+
+    context = multiprocessing.get_context("spawn")
+    with cf.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(RSSRun, generator, n).result()
+
+
+def benchmark_generators(generators: dict, dims: list[int], repeats: int = 5,
+                         eig_k: int = 0, memory: bool = True) -> list[dict]:
+    """
+    Benchmarks the adjacency matrix generators. The generation is run 'repeats' times,
+    the memory is measured in separate runs (the RSS in a fresh process, see 'GeneratorRSS'),
+    and the eigsh time (for 'eig_k' > 0) separately from the generation.
+    :param generators: Dict of {name: generator function}
+    :param dims: List of dimensions to test
+    :param repeats: Number of timed runs
+    :param eig_k: Number of smallest eigenvalues for the eigsh timing, 0 turns it off
+    :param memory: If False, the memory is not measured
+    :return: List of result records
+    """
+
+    records = []
+
+    for name, generator in generators.items():
+        for n in dims:
+            # Warm-up run, not measured
+            M = generator(n)
+
+            median, iqr = TimeRuns(lambda: generator(n), repeats)
+            record = dict(generator=name, N=n, repeats=repeats,
+                          median_s=median, iqr_s=iqr)
+            if memory:
+                record.update(peak_mem_mb=PeakMemory(lambda: generator(n)),
+                              peak_rss_mb=GeneratorRSS(generator, n))
+
+            if eig_k > 0:
+                k = min(eig_k, M.shape[0] - 1)
+                eig_median, eig_iqr = TimeRuns(
+                    lambda: scisp.linalg.eigsh(M, k=k, which='SA', return_eigenvectors=False), repeats)
+                record.update(eigsh_median_s=eig_median, eigsh_iqr_s=eig_iqr)
+
+            records.append(record)
+
+    return records
+
+
+def save_benchmark(records: list[dict], filename: str):
+    """
+    Saves the benchmark records, as JSON or CSV depending on the file extension.
+    :param records: Output of 'benchmark_generators'
+    :param filename: Name of the .json or .csv file
+    """
+
+    if filename.endswith(".csv"):
+        fields = list(dict.fromkeys(key for record in records for key in record))
+        with open(filename, "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(filename, "w") as file:
+            json.dump(records, file, indent=2)
+
+
+def load_benchmark(filename: str) -> list[dict]:
+    """
+    Loads benchmark records saved by 'save_benchmark'.
+    :param filename: Name of the .json or .csv file
+    :return: List of result records
+    """
+
+    if filename.endswith(".csv"):
+        with open(filename, newline="") as file:
+            records = list(csv.DictReader(file))
+        for record in records:
+            for key, value in record.items():
+                if key != "generator" and value != "":
+                    record[key] = int(value) if key in ("N", "repeats") else float(value)
+        return records
+
+    with open(filename) as file:
+        return json.load(file)
+
+
+def compare_benchmark(records: list[dict], baseline_file: str, tolerance: float = 0.2) -> list[dict]:
+    """
+    Compares the results with a stored baseline. A time counts as a regression, if it is
+    slower than the baseline by more than 'tolerance' (relative) plus the baseline's IQR.
+    :param records: Output of 'benchmark_generators'
+    :param baseline_file: Stored baseline, saved by 'save_benchmark'
+    :param tolerance: Allowed relative slowdown
+    :return: List of the regressions, with the baseline and the new values
+    """
+
+    baseline = {(record["generator"], record["N"]): record for record in load_benchmark(baseline_file)}
+    regressions = []
+
+    for record in records:
+        old = baseline.get((record["generator"], record["N"]))
+        if old is None:
+            continue
+
+        for key in ("median_s", "eigsh_median_s"):
+            if key not in record or key not in old or old[key] == "":
+                continue
+            limit = old[key] * (1 + tolerance) + old.get(key.replace("median", "iqr"), 0)
+            if record[key] > limit:
+                regressions.append(dict(generator=record["generator"], N=record["N"], metric=key,
+                                        baseline=old[key], new=record[key],
+                                        ratio=record[key] / old[key]))
+
+    return regressions
+
+
 # -------------------------------------------
 # Plotting Functions
 # -------------------------------------------
@@ -113,21 +628,23 @@ def SetTex():
     mpl.rcParams['font.serif'] = 'cm'
 
 
-def plot_timing(dims: list[int], times: list[float]):
+def plot_timing(dims: list[int], times: dict[str, list[float]]):
     """
     Plots the time it takes for every adjacency matrix to generate. On a logarithmic scale.
     :param dims: List of dimensions
-    :param times: List of measured times
+    :param times: Dict of {generator name: list of measured times}
     """
 
     fig, ax = plt.subplots(figsize=(8, 5))
 
-    ax.semilogy(dims, times, 'o-', color='steelblue', markersize=5)
+    for name, generator_times in times.items():
+        ax.semilogy(dims, generator_times, 'o-', markersize=5, label=name)
 
     ax.set_xlabel("Dimension (N)", fontsize=12)
     ax.set_ylabel("Generation time (s)", fontsize=12)
     ax.set_title("Hypercube adjacency matrix generation time vs. dimension", fontsize=13)
     ax.grid(True, alpha=0.3)
+    ax.legend()
 
     plt.tight_layout()
     plt.show()
@@ -176,8 +693,11 @@ if __name__ == "__main__":
     print("10 smallest eigenvalues of 8D hypercube:")
     print(np.round(eigs_8d).astype(int))
 
-    # Timing up to 22 dimensions
-    dims, times = measure_generation_times(max_dim=22)
+    # Verify the analytic Walsh-Hadamard solver against the numerical one
+    CheckHadamard(max_dim=8)
+
+    # Timing of both generators up to 22 dimensions, the median of 3 runs after a warm-up run
+    dims, times = measure_generation_times(max_dim=22, repeats=3)
     plot_timing(dims, times)
 
     # Eigenvectors of 6D cube
@@ -2,7 +2,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib as mpl
 import scipy.integrate as sciint
+import scipy.special as scispec
+import scipy.stats.qmc as sciqmc
+import os
 import time
+import json
+import statistics
+import tracemalloc
+import functools
+import concurrent.futures as cf
 
 
 # -------------------------------------------
@@ -23,7 +31,7 @@ def rho_xy(x: float, y: float, rho0: float, alpha: float) -> float:
     return float(rho0 * (1 + alpha * (x**2 + y**2)))
 
 
-def mass_cart(R: float, rho0: float, alpha: float):
+def mass_cart(R: float, rho0: float, alpha: float, tol: float = 1.49e-8, wrap=None):
     """
     The requested mass function. This calculates the
     mass using x and y, Cartesian coordinates.
@@ -32,6 +40,8 @@ def mass_cart(R: float, rho0: float, alpha: float):
     :param R: Radius of the disk
     :param rho0: Base surface mass density
     :param alpha: Inhomogeneity parameter
+    :param tol: Requested absolute and relative tolerance
+    :param wrap: Optional wrapper of the integrand, e.g. 'CountCalls.wrap'
     :return: The result and error of dblquad
     """
 
@@ -44,12 +54,15 @@ def mass_cart(R: float, rho0: float, alpha: float):
     def integrand(y, x):
         return rho_xy(x, y, rho0, alpha)
 
-    M, err = sciint.dblquad(integrand, -R, R, y_lower, y_upper)
+    if wrap is not None:
+        integrand = wrap(integrand)
+
+    M, err = sciint.dblquad(integrand, -R, R, y_lower, y_upper, epsabs=tol, epsrel=tol)
 
     return M, err
 
 
-def Iz_cart(R: float, rho0: float, alpha: float):
+def Iz_cart(R: float, rho0: float, alpha: float, tol: float = 1.49e-8, wrap=None):
     """
     The requested Iz function. This calculates the
     moment of inertia, with Cartesian coordinates x, y.
@@ -58,24 +71,30 @@ def Iz_cart(R: float, rho0: float, alpha: float):
     :param R: Radius of the disk
     :param rho0: Base surface mass density
     :param alpha: Inhomogeneity parameter
+    :param tol: Requested absolute and relative tolerance
+    :param wrap: Optional wrapper of the integrand, e.g. 'CountCalls.wrap'
     :return: The result and error of dblquad
     """
 
     def integrand(y, x, rho0, alpha):
         return (x**2 + y**2) * rho_xy(x, y, rho0, alpha)
 
+    if wrap is not None:
+        integrand = wrap(integrand)
+
     def y_lower(x):
         return -np.sqrt(R**2 - x**2)
 
     def y_upper(x):
         return np.sqrt(R**2 - x**2)
 
-    Iz, err = sciint.dblquad(integrand, -R, R, y_lower, y_upper, args=(rho0, alpha))
+    Iz, err = sciint.dblquad(integrand, -R, R, y_lower, y_upper, args=(rho0, alpha),
+                             epsabs=tol, epsrel=tol)
 
     return Iz, err
 
 
-def mass_polar(R: float, rho0: float, alpha: float):
+def mass_polar(R: float, rho0: float, alpha: float, tol: float = 1.49e-8, wrap=None):
     """
     The requested mass function. This calculates
     the mass using polar coordinates, where we skip
@@ -84,13 +103,18 @@ def mass_polar(R: float, rho0: float, alpha: float):
     :param R: Radius of the disk
     :param rho0: Base surface mass density
     :param alpha: Inhomogeneity parameter
+    :param tol: Requested absolute and relative tolerance
+    :param wrap: Optional wrapper of the integrand, e.g. 'CountCalls.wrap'
     :return: The result and error of quad
     """
 
     def integrand(r):
         return rho0 * (1 + alpha * r**2) * r
 
-    res, err = sciint.quad(integrand, 0, R)
+    if wrap is not None:
+        integrand = wrap(integrand)
+
+    res, err = sciint.quad(integrand, 0, R, epsabs=tol, epsrel=tol)
 
     M = 2 * np.pi * res
     err = 2 * np.pi * err
@@ -98,7 +122,7 @@ def mass_polar(R: float, rho0: float, alpha: float):
     return M, err
 
 
-def Iz_polar(R: float, rho0: float, alpha: float):
+def Iz_polar(R: float, rho0: float, alpha: float, tol: float = 1.49e-8, wrap=None):
     """
     The requested Iz function. This calculates
     the moment of inertia using polar coordinates, where we skip
@@ -107,13 +131,18 @@ def Iz_polar(R: float, rho0: float, alpha: float):
     :param R: Radius of the disk
     :param rho0: Base surface mass density
     :param alpha: Inhomogeneity parameter
+    :param tol: Requested absolute and relative tolerance
+    :param wrap: Optional wrapper of the integrand, e.g. 'CountCalls.wrap'
     :return: The result and error of quad
     """
 
     def integrand(r):
         return r**2 * rho0 * (1 + alpha * r**2) * r
 
-    res, err = sciint.quad(integrand, 0, R)
+    if wrap is not None:
+        integrand = wrap(integrand)
+
+    res, err = sciint.quad(integrand, 0, R, epsabs=tol, epsrel=tol)
 
     Iz = 2 * np.pi * res
     err = 2 * np.pi * err
@@ -121,6 +150,503 @@ def Iz_polar(R: float, rho0: float, alpha: float):
     return Iz, err
 
 
+# -------------------------------------------
+# Fixed-Order Quadrature
+# -------------------------------------------
+
+
+def rho_vec(x, y, rho0, alpha):
+    """
+    The vectorized rho function. Works on whole arrays of points and alpha values,
+    which are broadcast against each other.
+    :param x: x coordinates
+    :param y: y coordinates
+    :param rho0: Base surface mass density
+    :param alpha: Inhomogeneity parameter(s)
+    :return: The computed densities
+    """
+
+    return rho0 * (1 + alpha * (x**2 + y**2))
+
+
+def disk_nodes_cart(R: float, n: int):
+    """
+    Tensor-product Gauss nodes on the disk, in Cartesian coordinates.
+    With y = s * sqrt(R^2 - x^2) the inner integral is Gauss-Legendre in s on [-1, 1],
+    and the Jacobian sqrt(R^2 - x^2) is the weight of the Gauss-Jacobi (1/2, 1/2) rule in x,
+    so the square root at the boundary does not spoil the convergence.
+    :param R: Radius of the disk
+    :param n: Number of nodes along each direction
+    :return: x, y and weight arrays of the n*n nodes
+    """
+
+    t, wt = scispec.roots_jacobi(n, 0.5, 0.5)
+    s, ws = scispec.roots_legendre(n)
+
+    x = np.repeat(R * t, n)
+    y = (s[None, :] * R * np.sqrt(1 - t[:, None]**2)).ravel()
+    w = (R**2 * wt[:, None] * ws[None, :]).ravel()
+
+    return x, y, w
+
+
+def disk_nodes_polar(R: float, n_r: int, n_phi: int = None):
+    """
+    Tensor-product Gauss nodes on the disk, in polar coordinates.
+    The r dr measure is the weight of the Gauss-Jacobi (0, 1) rule, and phi uses
+    equally spaced points, which are exact for trigonometric polynomials.
+    :param R: Radius of the disk
+    :param n_r: Number of radial nodes
+    :param n_phi: Number of angular nodes, by default 2 * n_r
+    :return: x, y and weight arrays of the n_r*n_phi nodes
+    """
+
+    if n_phi is None:
+        n_phi = 2 * n_r
+
+    t, wt = scispec.roots_jacobi(n_r, 0.0, 1.0)
+    r = R * (1 + t) / 2
+    wr = (R / 2)**2 * wt
+
+    phi = 2 * np.pi * np.arange(n_phi) / n_phi
+
+    x = r[:, None] * np.cos(phi)[None, :]
+    y = r[:, None] * np.sin(phi)[None, :]
+    w = np.repeat(wr * 2 * np.pi / n_phi, n_phi)
+
+    return x.ravel(), y.ravel(), w
+
+
+def disk_integral(f, R: float, alpha_arr, n: int = 32, method: str = "polar"):
+    """
+    Integrates f(x, y, alpha) over the disk for every alpha at once. The integrand is
+    evaluated only once, on an (alpha, node) array, and summed with the weights.
+    :param f: Vectorized integrand, f(x, y, alpha)
+    :param R: Radius of the disk
+    :param alpha_arr: Array of alpha values
+    :param n: Number of nodes along each direction
+    :param method: "cart" or "polar"
+    :return: Array of the integrals, one for every alpha
+    """
+
+    if method == "cart":
+        x, y, w = disk_nodes_cart(R, n)
+    elif method == "polar":
+        x, y, w = disk_nodes_polar(R, n)
+    else:
+        raise ValueError(f"Unknown quadrature method: {method}")
+
+    alpha = np.asarray(alpha_arr, dtype=float)[..., None]
+
+    return f(x, y, alpha) @ w
+
+
+def mass_gauss(R: float, rho0: float, alpha_arr, n: int = 32, method: str = "polar"):
+    """
+    The mass for every alpha at once, with fixed-order Gauss quadrature.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param n: Number of nodes along each direction
+    :param method: "cart" or "polar"
+    :return: Array of the masses
+    """
+
+    def integrand(x, y, alpha):
+        return rho_vec(x, y, rho0, alpha)
+
+    return disk_integral(integrand, R, alpha_arr, n, method)
+
+
+def Iz_gauss(R: float, rho0: float, alpha_arr, n: int = 32, method: str = "polar"):
+    """
+    The moment of inertia for every alpha at once, with fixed-order Gauss quadrature.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param n: Number of nodes along each direction
+    :param method: "cart" or "polar"
+    :return: Array of the moments of inertia
+    """
+
+    def integrand(x, y, alpha):
+        return (x**2 + y**2) * rho_vec(x, y, rho0, alpha)
+
+    return disk_integral(integrand, R, alpha_arr, n, method)
+
+
+# -------------------------------------------
+# Quasi-Monte Carlo Integrals
+# -------------------------------------------
+
+
+def map_unit_cube(u, R: float):
+    """
+    Maps points of the unit square (cube) uniformly onto the disk (ball) of radius R.
+    In 2D r = R sqrt(u), phi = 2 pi v, in 3D r = R u^(1/3), cos(theta) = 1 - 2 v, phi = 2 pi w,
+    the roots making the density of the points uniform in area (volume).
+    :param u: Array of points, with the shape (n, 2) or (n, 3)
+    :param R: Radius of the disk or the ball
+    :return: Tuple of the coordinate arrays (x, y) or (x, y, z), and the area (volume) of the body
+    """
+
+    phi = 2 * np.pi * u[:, -1]
+
+    if u.shape[1] == 2:
+        r = R * np.sqrt(u[:, 0])
+        return (r * np.cos(phi), r * np.sin(phi)), np.pi * R**2
+
+    if u.shape[1] == 3:
+        r = R * np.cbrt(u[:, 0])
+        cos_theta = 1 - 2 * u[:, 1]
+        sin_theta = np.sqrt(1 - cos_theta**2)
+        return (r * sin_theta * np.cos(phi), r * sin_theta * np.sin(phi), r * cos_theta), 4 / 3 * np.pi * R**3
+
+    raise ValueError(f"Only disks (dim = 2) and balls (dim = 3) are supported, not dim = {u.shape[1]}")
+
+
+def qmc_integral(f, R: float, alpha_arr, dim: int = 2, n: int = 2**14, replicas: int = 8,
+                 batch: int = 2**12, seed=None):
+    """
+    Integrates f over the disk (dim = 2) or the ball (dim = 3) with scrambled Sobol points,
+    for every alpha at once. Every replica is an independently scrambled sequence, and the
+    spread of their results gives the error estimate. The points are drawn 'batch' at a time,
+    so only a (len(alpha), batch) array is in memory, whatever n is.
+    The error of a randomized QMC estimate falls about as 1/n, instead of the 1/sqrt(n) of plain
+    Monte Carlo, and unlike the tensor product rules the number of points does not grow with the dimension.
+    :param f: Vectorized integrand, f(x, y, alpha) or f(x, y, z, alpha), it can be any (noisy, tabulated) function
+    :param R: Radius of the disk or the ball
+    :param alpha_arr: Array of alpha values
+    :param dim: 2 for the disk, 3 for the ball
+    :param n: Number of points of each replica, a power of 2 keeps the balance of the Sobol sequence
+    :param replicas: Number of independent scrambles
+    :param batch: Number of points drawn at once, also a power of 2
+    :param seed: Seed of the scrambles
+    :return: Array of the integrals (mean of the replicas), array of their standard errors
+    """
+
+    alpha = np.asarray(alpha_arr, dtype=float)[..., None]
+    rng = np.random.default_rng(seed)
+    estimates = np.zeros((replicas,) + alpha.shape[:-1])
+
+    for i, generator in enumerate(rng.spawn(replicas)):
+        # With the default 30 bits, the points lie on a 2^-30 grid, which biases the result at 1e-9
+        engine = sciqmc.Sobol(dim, scramble=True, bits=64, seed=generator)
+        total = np.zeros(alpha.shape[:-1])
+
+        for start in range(0, n, batch):
+            coords, measure = map_unit_cube(engine.random(min(batch, n - start)), R)
+            total += np.sum(f(*coords, alpha), axis=-1)
+
+        estimates[i] = measure * total / n
+
+    return estimates.mean(axis=0), estimates.std(axis=0, ddof=1) / np.sqrt(replicas)
+
+
+def mass_qmc(density, R: float, alpha_arr, dim: int = 2, **options):
+    """
+    The mass of a disk (ball) with an arbitrary density, for every alpha at once, see 'qmc_integral'.
+    :param density: Vectorized density, density(x, y, alpha) or density(x, y, z, alpha)
+    :param R: Radius of the disk or the ball
+    :param alpha_arr: Array of alpha values
+    :param dim: 2 for the disk, 3 for the ball
+    :param options: Further arguments of 'qmc_integral' (n, replicas, batch, seed)
+    :return: Array of the masses, array of their standard errors
+    """
+
+    return qmc_integral(density, R, alpha_arr, dim, **options)
+
+
+def Iz_qmc(density, R: float, alpha_arr, dim: int = 2, **options):
+    """
+    The moment of inertia about the z axis of a disk (ball) with an arbitrary density,
+    for every alpha at once, see 'qmc_integral'.
+    :param density: Vectorized density, density(x, y, alpha) or density(x, y, z, alpha)
+    :param R: Radius of the disk or the ball
+    :param alpha_arr: Array of alpha values
+    :param dim: 2 for the disk, 3 for the ball
+    :param options: Further arguments of 'qmc_integral' (n, replicas, batch, seed)
+    :return: Array of the moments of inertia, array of their standard errors
+    """
+
+    def integrand(x, y, *rest):
+        return (x**2 + y**2) * density(x, y, *rest)
+
+    return qmc_integral(integrand, R, alpha_arr, dim, **options)
+
+
+# -------------------------------------------
+# Vector-Valued Adaptive Integrals
+# -------------------------------------------
+
+
+def exact_mass(R: float, rho0: float, alpha):
+    """
+    The analytic mass, 2 pi rho0 (R^2 / 2 + alpha R^4 / 4), for checking the accuracy.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha: Inhomogeneity parameter(s)
+    :return: The exact mass
+    """
+
+    return 2 * np.pi * rho0 * (R**2 / 2 + np.asarray(alpha) * R**4 / 4)
+
+
+def exact_Iz(R: float, rho0: float, alpha):
+    """
+    The analytic moment of inertia, 2 pi rho0 (R^4 / 4 + alpha R^6 / 6), for checking the accuracy.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha: Inhomogeneity parameter(s)
+    :return: The exact moment of inertia
+    """
+
+    return 2 * np.pi * rho0 * (R**4 / 4 + np.asarray(alpha) * R**6 / 6)
+
+
+def NestedQuadVec(f, a: float, b: float, bounds, epsrel: float):
+    """
+    Integrates f(u, w) for u in [a, b] and w in bounds(u), with two nested 'quad_vec' calls.
+    The error estimates of the inner integrals are integrated along with their values,
+    and added to the error of the outer one, so the result does not understate the error.
+    :param f: Vector-valued integrand, f(u, w)
+    :param a: Lower bound of u
+    :param b: Upper bound of u
+    :param bounds: Function of u, giving the bounds of w
+    :param epsrel: Requested relative tolerance
+    :return: Array of values, array of error estimates
+    """
+
+    def inner(u):
+        lower, upper = bounds(u)
+        res, err = sciint.quad_vec(lambda w: f(u, w), lower, upper, epsrel=epsrel)
+        res = np.ravel(res)
+        return np.concatenate([res, np.broadcast_to(err, res.shape)])
+
+    total, err = sciint.quad_vec(inner, a, b, epsrel=epsrel)
+    n = total.size // 2
+
+    return total[:n], err + total[n:]
+
+
+def disk_integral_vec(f, R: float, alpha_arr, method: str = "polar", epsrel: float = 1e-10):
+    """
+    Integrates f(x, y, alpha) over the disk adaptively, for every alpha at once:
+    the integrand returns a whole vector (one value per alpha) at each point.
+    "polar" nests two 'quad_vec' calls, in r and in phi. "radial" is only for rotationally
+    symmetric integrands, like the ones of 'mass_polar' and 'Iz_polar': it evaluates f
+    along phi = 0 only, and multiplies by 2 pi, with a single 'quad_vec' in r.
+    "cart" nests two 'quad_vec' calls with the sqrt bounds, and "cubature" maps the disk onto a rectangle for the N-D adaptive
+    'scipy.integrate.cubature', with x = R sin(theta) and y = s * R cos(theta).
+    This substitution makes the Jacobian R^2 cos^2(theta) smooth, so there is no
+    square root singularity at the edge of the disk.
+    :param f: Vectorized integrand, f(x, y, alpha)
+    :param R: Radius of the disk
+    :param alpha_arr: Array of alpha values
+    :param method: "polar", "radial", "cart" or "cubature"
+    :param epsrel: Requested relative tolerance
+    :return: Array of values, array of error estimates
+    """
+
+    alpha = np.asarray(alpha_arr, dtype=float)
+
+    if method == "polar":
+        def integrand(r, phi):
+            return r * f(r * np.cos(phi), r * np.sin(phi), alpha)
+
+        res, err = NestedQuadVec(integrand, 0, R, lambda r: (0, 2 * np.pi), epsrel)
+
+    elif method == "radial":
+        def integrand(r):
+            return 2 * np.pi * r * f(r, 0.0, alpha)
+
+        res, err = sciint.quad_vec(integrand, 0, R, epsrel=epsrel)
+
+    elif method == "cart":
+        def bounds(x):
+            h = np.sqrt(R**2 - x**2)
+            return -h, h
+
+        res, err = NestedQuadVec(lambda x, y: f(x, y, alpha), -R, R, bounds, epsrel)
+
+    elif method == "cubature":
+        if not hasattr(sciint, "cubature"):
+            raise RuntimeError("'scipy.integrate.cubature' needs SciPy 1.15 or newer.")
+
+        def integrand(points):
+            # points has the shape (n, 2), the output (n, len(alpha))
+            x = R * np.sin(points[:, :1])
+            h = R * np.cos(points[:, :1])
+            return f(x, points[:, 1:] * h, alpha[None, :]) * h**2
+
+        result = sciint.cubature(integrand, [-np.pi / 2, -1], [np.pi / 2, 1], rtol=epsrel)
+        res, err = result.estimate, result.error
+
+    else:
+        raise ValueError(f"Unknown integration method: {method}")
+
+    return res, np.broadcast_to(err, res.shape).copy()
+
+
+def mass_vec(R: float, rho0: float, alpha_arr, method: str = "radial", epsrel: float = 1e-10):
+    """
+    The mass for every alpha at once, with a vector-valued adaptive integral.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param method: "radial", "polar", "cart" or "cubature" (the density is rotationally symmetric)
+    :param epsrel: Requested relative tolerance
+    :return: Array of masses, array of error estimates
+    """
+
+    def integrand(x, y, alpha):
+        return rho_vec(x, y, rho0, alpha)
+
+    return disk_integral_vec(integrand, R, alpha_arr, method, epsrel)
+
+
+def Iz_vec(R: float, rho0: float, alpha_arr, method: str = "radial", epsrel: float = 1e-10):
+    """
+    The moment of inertia for every alpha at once, with a vector-valued adaptive integral.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param method: "radial", "polar", "cart" or "cubature" (the integrand is rotationally symmetric)
+    :param epsrel: Requested relative tolerance
+    :return: Array of moments of inertia, array of error estimates
+    """
+
+    def integrand(x, y, alpha):
+        return (x**2 + y**2) * rho_vec(x, y, rho0, alpha)
+
+    return disk_integral_vec(integrand, R, alpha_arr, method, epsrel)
+
+
+class CountCalls:
+    """
+    Counts how many times the wrapped integrands were called, and at how many
+    points they were evaluated (a vectorized call counts every point).
+    One counter can wrap many integrands, e.g. the new one of every alpha in a loop.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.points = 0
+
+    def wrap(self, function):
+        @functools.wraps(function)
+        def counted(*args):
+            self.calls += 1
+            self.points += np.broadcast(*args[:2]).size
+            return function(*args)
+
+        return counted
+
+
+FIXED_METHODS = ("Gauss polar", "Gauss cart", "Sobol QMC")
+
+
+def IntegratorTable(R: float, rho0: float, alpha_arr, quantity: str = "Iz") -> dict:
+    """
+    Makes the table of the compared integrators. Every entry is a function of
+    (tol, wrap), which calculates the quantity for every alpha, with 'wrap' put around the integrand.
+    The fixed-order Gauss rules and the QMC integral have no tolerance, their entries ignore it.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param quantity: "M" or "Iz"
+    :return: Dictionary of method name -> function
+    """
+
+    scalar = {"M": (mass_cart, mass_polar), "Iz": (Iz_cart, Iz_polar)}[quantity]
+
+    def f(x, y, alpha):
+        weight = 1.0 if quantity == "M" else x**2 + y**2
+        return weight * rho_vec(x, y, rho0, alpha)
+
+    def vec(method):
+        return lambda tol, wrap: disk_integral_vec(wrap(f), R, alpha_arr, method, tol)[0]
+
+    def gauss(method):
+        return lambda tol, wrap: disk_integral(wrap(f), R, alpha_arr, method=method)
+
+    def sobol(tol, wrap):
+        return qmc_integral(wrap(f), R, alpha_arr, seed=0)[0]
+
+    methods = {
+        "dblquad (loop)": lambda tol, wrap: [scalar[0](R, rho0, alpha, tol, wrap)[0] for alpha in alpha_arr],
+        "quad (loop)": lambda tol, wrap: [scalar[1](R, rho0, alpha, tol, wrap)[0] for alpha in alpha_arr],
+        "quad_vec radial": vec("radial"),
+        "quad_vec cart": vec("cart"),
+        "Gauss polar": gauss("polar"),
+        "Gauss cart": gauss("cart"),
+        "Sobol QMC": sobol,
+    }
+    if hasattr(sciint, "cubature"):
+        methods["cubature"] = vec("cubature")
+
+    return methods
+
+
+def compare_integrators(R: float, rho0: float, alpha_arr, tols=(1e-10,), repeats: int = 5,
+                        warmup: int = 1, quantity: str = "Iz", methods=None) -> list[dict]:
+    """
+    Benchmarks every integrator, for every requested tolerance. Each method is run 'warmup' times
+    untimed first, then 'repeats' times, and the median (and spread) of the wall times is recorded,
+    so one slow first call or a hiccup of the machine does not decide the result.
+    The integrand evaluations and the peak memory (tracemalloc) are measured in separate runs,
+    so they do not slow down the timed ones.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param tols: Requested tolerances (the methods in FIXED_METHODS are run only once, with tol None)
+    :param repeats: Number of timed runs
+    :param warmup: Number of untimed runs before them
+    :param quantity: "M" or "Iz"
+    :param methods: Names of the methods to run, None for all of them
+    :return: List of records, with the keys 'method', 'tol', 'time_s' (median), 'time_min', 'time_max',
+        'repeats', 'calls', 'points', 'max_error', 'rel_error', 'meets_tol' and 'peak_kb'
+    """
+
+    table = IntegratorTable(R, rho0, alpha_arr, quantity)
+    if methods is not None:
+        table = {name: table[name] for name in methods}
+
+    exact = (exact_mass if quantity == "M" else exact_Iz)(R, rho0, np.asarray(alpha_arr, dtype=float))
+    records = []
+
+    for name, function in table.items():
+        for tol in ((None,) if name in FIXED_METHODS else tols):
+            run = functools.partial(function, tol, lambda g: g)
+
+            for _ in range(warmup):
+                run()
+
+            times = []
+            for _ in range(repeats):
+                t0 = time.perf_counter()
+                values = np.asarray(run())
+                times.append(time.perf_counter() - t0)
+
+            counter = CountCalls()
+            function(tol, counter.wrap)
+
+            tracemalloc.start()
+            run()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            rel_error = float(np.max(np.abs(values - exact) / np.abs(exact)))
+            records.append(dict(method=name, tol=tol, time_s=statistics.median(times),
+                                time_min=min(times), time_max=max(times), repeats=repeats,
+                                calls=counter.calls, points=counter.points,
+                                max_error=float(np.max(np.abs(values - exact))), rel_error=rel_error,
+                                meets_tol=None if tol is None else rel_error <= tol,
+                                peak_kb=peak / 1024))
+
+    return records
+
+
 # -------------------------------------------
 # SetTex
 # -------------------------------------------
@@ -136,229 +662,230 @@ def SetTex():
     mpl.rcParams['font.serif'] = 'cm'
 
 
-def compute_all(R: float, rho0: float, alpha_arr):
+def sweep_alpha(func, alpha_arr, linear=None, workers=None, rtol=1e-8):
     """
-    Computes mass, moment of inertia, errors, and timing for every alpha value,
-    using both Cartesian and polar methods.
-    :param R: Radius of the disk
-    :param rho0: Base surface mass density
+    Calculates func(alpha) for every alpha. If the integral is linear in alpha
+    (I = I0 + alpha * I1, as for rho0 * (1 + alpha * r^2)), only the two basis terms
+    are integrated, and every alpha is assembled with one NumPy operation.
+    Otherwise the alphas are integrated one by one on a process pool.
+    :param func: Integral as a function of alpha, returning (value, error)
     :param alpha_arr: Array of alpha values
-    :return: Dictionary with all computed arrays
+    :param linear: True or False if it is known, None to detect it with one extra integral
+    :param workers: Number of worker processes for the non-linear case
+    :param rtol: Relative tolerance of the linearity check
+    :return: Array of values, array of errors
     """
 
-    n = len(alpha_arr)
-
-    M_c     = np.empty(n)
-    M_p     = np.empty(n)
-    Iz_c    = np.empty(n)
-    Iz_p    = np.empty(n)
-    M_c_err  = np.empty(n)
-    M_p_err  = np.empty(n)
-    Iz_c_err = np.empty(n)
-    Iz_p_err = np.empty(n)
-    t_cart  = np.empty(n)
-    t_polar = np.empty(n)
-
-    for i, alpha in enumerate(alpha_arr):
-        # Mass
-        M_p[i], M_p_err[i] = mass_polar(R, rho0, alpha)
-        M_c[i], M_c_err[i] = mass_cart(R, rho0, alpha)
-
-        # Iz — Cartesian (timed)
-        t0 = time.perf_counter()
-        Iz_c[i], Iz_c_err[i] = Iz_cart(R, rho0, alpha)
-        t_cart[i] = time.perf_counter() - t0
-
-        # Iz — polar (timed)
-        t0 = time.perf_counter()
-        Iz_p[i], Iz_p_err[i] = Iz_polar(R, rho0, alpha)
-        t_polar[i] = time.perf_counter() - t0
-
-    return {
-        "M_c": M_c, "M_p": M_p,
-        "Iz_c": Iz_c, "Iz_p": Iz_p,
-        "M_c_err": M_c_err, "M_p_err": M_p_err,
-        "Iz_c_err": Iz_c_err, "Iz_p_err": Iz_p_err,
-        "t_cart": t_cart, "t_polar": t_polar,
-    }
+    alpha_arr = np.asarray(alpha_arr, dtype=float)
+
+    if linear is not False:
+        v0, e0 = func(0.0)
+        v1, e1 = func(1.0)
+
+        if linear is None:
+            # The probe is not a simple fraction, so an accidental match is unlikely
+            probe = 0.6180339887
+            vp, ep = func(probe)
+            expected = (1 - probe) * v0 + probe * v1
+            linear = abs(vp - expected) <= 10 * (e0 + e1 + ep) + rtol * abs(expected)
+
+        if linear:
+            values = (1 - alpha_arr) * v0 + alpha_arr * v1
+            errors = np.abs(1 - alpha_arr) * e0 + np.abs(alpha_arr) * e1
+            return values, errors
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(alpha_arr) // (4 * workers))
+
+    with cf.ProcessPoolExecutor(workers) as pool:
+        results = list(pool.map(func, alpha_arr, chunksize=chunksize))
+
+    values, errors = np.array(results).T
+    return values, errors
+
 
 # -------------------------------------------
 # Calculations
 # -------------------------------------------
 
+# Next to this file, so it does not depend on the directory the script is started from
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".integration_cache.json")
 
-class Calculate:
-    """This class makes the calculation of mass and moment of inertia."""
-
-    def __init__(self, R, rho0, alpha_data):
-        # Initialization constants
-        self.R = R
-        self.rho0 = rho0
-        self.alpha_data = alpha_data
-        # ------------------------
 
-        n = len(self.alpha_data)
+class IntegrationService:
+    """
+    This class makes the calculation of mass and moment of inertia.
+    Every result is kept in a cache, keyed by (quantity, R, rho0, alpha, method, tolerance, mode),
+    which is saved to disk, so the plots and later runs reuse the results instead of integrating again.
+    The mode tells a direct integral ("direct") from one assembled by 'sweep_alpha' ("sweep"),
+    so the two never stand in for each other. The measured times are only kept in memory,
+    as a time from an earlier session (or another machine) says nothing about this one.
+    """
 
-        # Data
-        self.M_c = np.empty(n)
-        self.M_p = np.empty(n)
-        self.Iz_c = np.empty(n)
-        self.Iz_p = np.empty(n)
-        self.M_c_err = np.empty(n)
-        self.M_p_err = np.empty(n)
-        self.Iz_c_err = np.empty(n)
-        self.Iz_p_err = np.empty(n)
-        self.t_cart = np.empty(n)
-        self.t_polar = np.empty(n)
+    INTEGRALS = {("M", "cart"): mass_cart, ("Iz", "cart"): Iz_cart,
+                 ("M", "polar"): mass_polar, ("Iz", "polar"): Iz_polar}
 
-        # ------------------------
+    def __init__(self, cache_file=CACHE_FILE):
+        self.cache_file = cache_file
+        self.cache = {}
+        self.timings = {}
 
-        self.main()
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file) as file:
+                self.cache = json.load(file)
 
-    def rho_xy(self, x: float, y: float, alpha: float) -> float:
+    @staticmethod
+    def key(quantity, method, R, rho0, alpha, tol, mode="direct"):
         """
-        The class version of rho function. Computes the density at given x, y.
-        :param x: x coordinate
-        :param y: y coordinate
-        :param self.rho0: Base surface mass density
-        :param alpha: Inhomogeneity parameter
-        :return: The computed density at given x, y points.
+        Makes the cache key. The floats are written with repr, so they are read back exactly.
         """
 
-        return float(self.rho0 * (1 + alpha * (x ** 2 + y ** 2)))
+        return repr((quantity, float(R), float(rho0), float(alpha), method, float(tol), mode))
 
-    def mass_cart(self, alpha: float) -> tuple:
+    def integrate(self, quantity, method, R, rho0, alpha, tol=1.49e-8, timed=False):
         """
-        he class version of mass function. This calculates the
-        mass using x and y, Cartesian coordinates.
-        The integration bounds for x is [-R, R], and
-        for y it is [y_lower, y_upper] respectively.
-        :param self.R: Radius of the disk
-        :param self.rho0: Base surface mass density
+        Gives one integral from the cache, or calculates (and times) it.
+        :param quantity: "M" or "Iz"
+        :param method: "cart" or "polar"
+        :param R: Radius of the disk
+        :param rho0: Base surface mass density
         :param alpha: Inhomogeneity parameter
-        :return: The result and error of dblquad
+        :param tol: Requested absolute and relative tolerance
+        :param timed: If True, the integral is calculated even if it is cached, unless it was already timed in this session
+        :return: The result, the error, and the time of the calculation (NaN, if it was not timed in this session)
         """
 
-        def y_lower(x):
-            return -np.sqrt(self.R ** 2 - x ** 2)
-
-        def y_upper(x):
-            return np.sqrt(self.R ** 2 - x ** 2)
+        key = self.key(quantity, method, R, rho0, alpha, tol)
 
-        def integrand(y, x):
-            return self.rho_xy(x, y, alpha)
-
-        M, err = sciint.dblquad(integrand, -self.R, self.R, y_lower, y_upper)
+        if key not in self.cache or (timed and key not in self.timings):
+            t0 = time.perf_counter()
+            value, err = self.INTEGRALS[quantity, method](R, rho0, alpha, tol)
+            self.timings[key] = time.perf_counter() - t0
+            self.cache[key] = [value, err]
 
-        return M, err
+        return tuple(self.cache[key]) + (self.timings.get(key, np.nan),)
 
-    def Iz_cart(self, alpha: float) -> tuple:
+    def sweep(self, quantity, method, R, rho0, alpha_arr, tol=1.49e-8):
         """
-        he class version of Iz function. This calculates the
-        moment of inertia, with Cartesian coordinates x, y.
-        The integration bounds for x is [-R, R], and
-        for y it is [y_lower, y_upper] respectively.
-        :param self.R: Radius of the disk
-        :param self.rho0: Base surface mass density
-        :param alpha: Inhomogeneity parameter
-        :return: The result and error of dblquad
+        Calculates the alphas together with 'sweep_alpha', and puts the missing ones into the cache, under the "sweep" mode.
+        The time of the sweep is spread evenly over the calculated alphas.
+        :return: Array of the results, the errors and the times (NaN, if not timed in this session), with the shape (len(alpha), 3)
         """
 
-        def integrand(y, x):
-            return (x ** 2 + y ** 2) * self.rho_xy(x, y, alpha)
+        keys = [self.key(quantity, method, R, rho0, alpha, tol, "sweep") for alpha in alpha_arr]
+        missing = [alpha for alpha, key in zip(alpha_arr, keys) if key not in self.cache]
 
-        def y_lower(x):
-            return -np.sqrt(self.R ** 2 - x ** 2)
+        if missing:
+            func = functools.partial(self.INTEGRALS[quantity, method], R, rho0, tol=tol)
 
-        def y_upper(x):
-            return np.sqrt(self.R ** 2 - x ** 2)
+            t0 = time.perf_counter()
+            values, errors = sweep_alpha(func, missing)
+            elapsed = (time.perf_counter() - t0) / len(missing)
 
-        Iz, err = sciint.dblquad(integrand, -self.R, self.R, y_lower, y_upper)
+            for alpha, value, err in zip(missing, values, errors):
+                key = self.key(quantity, method, R, rho0, alpha, tol, "sweep")
+                self.cache[key] = [float(value), float(err)]
+                self.timings[key] = elapsed
 
-        return Iz, err
+        return np.array([self.cache[key] + [self.timings.get(key, np.nan)] for key in keys]).reshape(-1, 3)
 
-    def mass_polar(self, alpha: float) -> tuple:
+    def compute(self, R, rho0, alpha_arr, tol=1.49e-8, sweep=False, timed=False):
         """
-        he class version of mass function. This calculates
-        the mass using polar coordinates, where we skip
-        the integration of 'phi', and assume it is 2*pi.
-        Thus leaving us with 'r', for which the bounds are [0, R]
-        :param self.R: Radius of the disk
-        :param self.rho0: Base surface mass density
-        :param alpha: Inhomogeneity parameter
-        :return: The result and error of quad
+        Computes mass, moment of inertia, errors, and timing for every alpha value,
+        using both Cartesian and polar methods.
+        :param R: Radius of the disk
+        :param rho0: Base surface mass density
+        :param alpha_arr: Array of alpha values
+        :param tol: Requested absolute and relative tolerance
+        :param sweep: If True, the alphas are calculated together, see 'sweep_alpha'
+        :param timed: If True, the I_z integrals not yet timed in this session are calculated again,
+            so 't_cart' and 't_polar' are all measured now (otherwise they are NaN for the cached results)
+        :return: Dictionary with all computed arrays
         """
 
-        def integrand(r):
-            return self.rho0 * (1 + alpha * r ** 2) * r
+        names = {("M", "cart"): "M_c", ("M", "polar"): "M_p",
+                 ("Iz", "cart"): "Iz_c", ("Iz", "polar"): "Iz_p"}
+        timed_names = {("Iz", "cart"): "t_cart", ("Iz", "polar"): "t_polar"}
+
+        data = {}
 
-        res, err = sciint.quad(integrand, 0, self.R)
+        for (quantity, method), name in names.items():
+            if sweep:
+                results = self.sweep(quantity, method, R, rho0, alpha_arr, tol)
+            else:
+                results = np.array([self.integrate(quantity, method, R, rho0, alpha, tol,
+                                                   timed and (quantity, method) in timed_names)
+                                    for alpha in alpha_arr]).reshape(-1, 3)
 
-        M = 2 * np.pi * res
-        err = 2 * np.pi * err
+            data[name] = results[:, 0]
+            data[name + "_err"] = results[:, 1]
+            if (quantity, method) in timed_names:
+                data[timed_names[quantity, method]] = results[:, 2]
 
-        return M, err
+        self.save()
 
-    def Iz_polar(self, alpha: float) -> tuple:
+        return data
+
+    def save(self):
         """
-        he class version of Iz function. This calculates
-        the moment of inertia using polar coordinates, where we skip
-        the integration of 'phi', and assume it is 2*pi.
-        Thus leaving us with 'r', for which the bounds are [0, R]
-        :param self.R: Radius of the disk
-        :param self.rho0: Base surface mass density
-        :param alpha: Inhomogeneity parameter
-        :return: The result and error of quad
+        Writes the cache to disk, under a temporary name first, so it is never left half written.
         """
 
-        def integrand(r):
-            return r ** 2 * self.rho0 * (1 + alpha * r ** 2) * r
+        if self.cache_file is None:
+            return
 
-        res, err = sciint.quad(integrand, 0, self.R)
+        tmp = self.cache_file + ".tmp"
+        with open(tmp, "w") as file:
+            json.dump(self.cache, file)
+        os.replace(tmp, self.cache_file)
 
-        Iz = 2 * np.pi * res
-        err = 2 * np.pi * err
 
-        return Iz, err
+# Made by 'GetService' at the first use, so importing this file does not read the cache
+SERVICE = None
 
-    def main(self):
-        """
-        Computes mass, moment of inertia, errors, and timing for every alpha value,
-        using both Cartesian and polar methods.
-        :param self.R: Radius of the disk
-        :param self.rho0: Base surface mass density
-        :param self.alpha_data: Array of alpha values
-        :return: Dictionary with all computed arrays
-        """
 
-        for i, alpha in enumerate(self.alpha_data):
-            # Mass
-            self.M_p[i], self.M_p_err[i] = self.mass_polar(alpha)
-            self.M_c[i], self.M_c_err[i] = self.mass_cart(alpha)
+def GetService():
+    """
+    Gives the shared 'IntegrationService', and makes it at the first call.
+    """
 
-            # Iz — Cartesian (timed)
-            t0 = time.perf_counter()
-            self.Iz_c[i], self.Iz_c_err[i] = self.Iz_cart(alpha)
-            self.t_cart[i] = time.perf_counter() - t0
+    global SERVICE
 
-            # Iz — polar (timed)
-            t0 = time.perf_counter()
-            self.Iz_p[i], self.Iz_p_err[i] = self.Iz_polar(alpha)
-            self.t_polar[i] = time.perf_counter() - t0
+    if SERVICE is None:
+        SERVICE = IntegrationService()
 
+    return SERVICE
 
-def GetData(R, rho0, alpha_data):
+
+def compute_all(R: float, rho0: float, alpha_arr, sweep: bool = False, tol: float = 1.49e-8,
+                timed: bool = False):
     """
-    This function only initializes the class,
-    thus making its results easier to handle.
+    Computes mass, moment of inertia, errors, and timing for every alpha value,
+    using both Cartesian and polar methods, through the shared 'IntegrationService'.
+    :param R: Radius of the disk
+    :param rho0: Base surface mass density
+    :param alpha_arr: Array of alpha values
+    :param sweep: If True, the alphas are calculated together, see 'sweep_alpha'
+    :param tol: Requested absolute and relative tolerance
+    :param timed: If True, the I_z timings are all measured in this session, see 'IntegrationService.compute'
+    :return: Dictionary with all computed arrays
+    """
+
+    return GetService().compute(R, rho0, alpha_arr, tol, sweep, timed)
+
+
+def GetData(R, rho0, alpha_data, sweep=False, timed=False):
+    """
+    This function only calls 'compute_all', thus making its results easier to handle.
     :param R: Radius of the disk
     :param rho0: Base surface mass density
     :param alpha_data: Array of alpha values
+    :param sweep: If True, the alphas are calculated together, see 'sweep_alpha'
+    :param timed: If True, the I_z timings are all measured in this session
     :return: The results of the computations
     """
 
-    cal = Calculate(R, rho0, alpha_data)
-    return vars(cal)
+    return compute_all(R, rho0, alpha_data, sweep, timed=timed)
 
 # -------------------------------------------
 # Plotting Functions
@@ -434,14 +961,50 @@ def plot_accuracy(alpha_data, data):
     plt.show()
 
 
-def plot_timing(alpha_data, data):
+def plot_timing(alpha_data, data, comparison=None):
     """
     Plots the computation time of I_z for both methods as a function of alpha.
+    If a comparison is given, the accuracy and median total time of every method is plotted next to it,
+    the runs of one method at different tolerances joined by a line, and the range of the
+    repeated timings shown as an error bar.
     :param alpha_data: Array of alpha values
     :param data: Dictionary of results
+    :param comparison: Records of 'compare_integrators'
     """
 
-    fig, ax = plt.subplots(figsize=(8, 5))
+    if comparison is None:
+        fig, ax = plt.subplots(figsize=(8, 5))
+    else:
+        fig, (ax, ax_cmp) = plt.subplots(1, 2, figsize=(14, 5))
+
+        methods = dict.fromkeys(record["method"] for record in comparison)
+
+        for method in methods:
+            records = sorted((record for record in comparison if record["method"] == method),
+                             key=lambda record: record["time_s"])
+            times = np.array([record["time_s"] for record in records])
+            # Exact results are shown at the machine precision, so they fit on the log scale
+            errors = np.maximum([record["max_error"] for record in records], np.finfo(float).eps)
+            spread = None
+            if "time_min" in records[0]:
+                spread = [times - [record["time_min"] for record in records],
+                          [record["time_max"] for record in records] - times]
+
+            ax_cmp.errorbar(times, errors, xerr=spread, fmt='o-', markersize=5, capsize=3, label=method)
+
+            for record, t, error in zip(records, times, errors):
+                if record.get("tol") is not None:
+                    ax_cmp.annotate(f"{record['tol']:.0e}", (t, error),
+                                    textcoords="offset points", xytext=(5, 5), fontsize=8)
+
+        ax_cmp.set_xscale("log")
+        ax_cmp.set_yscale("log")
+        ax_cmp.legend(fontsize=8)
+
+        ax_cmp.set_xlabel("Median total time for all alphas (s)", fontsize=12)
+        ax_cmp.set_ylabel(r"Max. error of $I_z$", fontsize=12)
+        ax_cmp.set_title("Accuracy vs. time of the integrators", fontsize=13)
+        ax_cmp.grid(True, alpha=0.3, which='both')
 
     ax.plot(alpha_data, data["t_cart"], '-', color='steelblue', label="Cartesian (dblquad)", linewidth=1.2)
     ax.plot(alpha_data, data["t_polar"], '-', color='indianred', label="Polar (quad)", linewidth=1.2)
@@ -467,9 +1030,9 @@ if __name__ == "__main__":
     rho0 = 1.0
     alpha_data = np.linspace(-0.9, 1.0, 200)
 
-    #data = compute_all(R, rho0, alpha_data)
-
-    data = GetData(R, rho0, alpha_data)
+    # Every plot uses these results, and a repeated run reads them from the cache,
+    # except the I_z integrals, which are timed again for the timing plot
+    data = compute_all(R, rho0, alpha_data, timed=True)
 
     # Plot 1: Iz / (M R^2) vs alpha
     plot_Iz_over_MR2(alpha_data, data, R)
@@ -485,8 +1048,14 @@ if __name__ == "__main__":
     # Plot 2: Accuracy comparison
     plot_accuracy(alpha_data, data)
 
-    # Plot 3: Timing comparison
-    plot_timing(alpha_data, data)
+    # Plot 3: Timing comparison, with the vectorized integrators next to it
+    # (every 10th alpha only, as each method is run several times at two tolerances)
+    comparison = compare_integrators(R, rho0, alpha_data[::10], tols=(1e-6, 1e-10), repeats=3)
+    for record in comparison:
+        print(f"{record['method']:>16} tol={record['tol']!s:>6}: {record['time_s']:.2e} s, "
+              f"{record['points']:>8} points, rel. error {record['rel_error']:.1e}, "
+              f"peak {record['peak_kb']:.0f} kB")
+    plot_timing(alpha_data, data, comparison)
 
     # Interpretation for timing
     print(
@@ -3,7 +3,13 @@ import matplotlib.pyplot as plt
 import matplotlib as mpl
 import scipy.integrate as sciint
 import scipy.interpolate as sciintp
+import scipy.optimize as sciopt
 import ipywidgets as wid
+import os
+import json
+import functools
+import multiprocessing
+import concurrent.futures as cf
 
 # -------------------------------------------
 # Constants
@@ -12,39 +18,55 @@ import ipywidgets as wid
 H0 = 1.0
 L0 = 1.0
 
+# Settings of the integration, shared by the single and the batched solver
+T_MAX = 50
+MAX_STEP = 0.01
+RTOL = 1e-10
+ATOL = 1e-12
+H_PLATE = 1e-3
+
+# The impact points of 'scan_impact' are kept here between runs,
+# next to this file, so it does not depend on the directory the script is started from
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".impact_cache.json")
+
 
 # -------------------------------------------
 # Calculations
 # -------------------------------------------
 
 
-def solve_trajectory(v0: float, h0: float = H0, l0: float = L0):
+def derivatives(t: float, state: np.ndarray) -> np.ndarray:
     """
-    This function solves the ODE.
-    :param v0: Initial horizontal velocity
-    :param h0: Initial height from the metal plate
-    :param l0: Initial horizontal position
-    :return: OdeResult object from 'solve_ivp'
+    This function contains the equations, and is given to 'solve_ivp'.
+    It is vectorized: the state may hold K trajectories, as [h_1..h_K, l_1..l_K, vh_1..vh_K, vl_1..vl_K].
+    :param t: Current time, required by 'solve_ivp'
+    :param state: State vector [h, l, vh, vl], with the shape (4,) or (4K,)
+    :return: Time derivatives, velocity and acceleration, with the shape of the state
     """
 
-    def derivatives(t: float, state: np.ndarray) -> list[float]:
-        """
-        This function contains the equations, and is given to 'solve_ivp'.
-        :param t: Current time, required by 'solve_ivp'
-        :param state: State vector [h, l, vh, vl]
-        :return: Time derivatives, velocity and acceleration
-        """
+    h, l, vh, vl = np.reshape(state, (4, -1))
 
-        h, l, vh, vl = state
+    r_sq = h ** 2 + l ** 2
+    r_32 = r_sq ** 1.5
 
-        r_sq = h ** 2 + l ** 2
-        r_32 = r_sq ** 1.5
+    # Equations
+    ah = -h / (4 * r_32) - 1 / (4 * h ** 2)
+    al = -l / (4 * r_32) + 1 / (4 * l ** 2)
 
-        # Equations
-        ah = -h / (4 * r_32) - 1 / (4 * h ** 2)
-        al = -l / (4 * r_32) + 1 / (4 * l ** 2)
+    return np.concatenate([vh, vl, ah, al])
 
-        return [vh, vl, ah, al]
+
+@functools.lru_cache(maxsize=256)
+def solve_trajectory(v0: float, h0: float = H0, l0: float = L0):
+    """
+    This function solves the ODE. The solutions (with their dense output) are kept
+    in memory, so going back on the slider, or asking for the impact point of a plotted
+    trajectory, does not integrate again. The result must not be modified.
+    :param v0: Initial horizontal velocity
+    :param h0: Initial height from the metal plate
+    :param l0: Initial horizontal position
+    :return: OdeResult object from 'solve_ivp'
+    """
 
     def hit_plate(t: float, state: np.ndarray):
         """
@@ -56,7 +78,7 @@ def solve_trajectory(v0: float, h0: float = H0, l0: float = L0):
         :return: Distance from threshold (h - 1e-3)
         """
 
-        return state[0] - 1e-3
+        return state[0] - H_PLATE
 
     # If event is true, integration will stop at that threshold.
     hit_plate.terminal = True
@@ -68,22 +90,22 @@ def solve_trajectory(v0: float, h0: float = H0, l0: float = L0):
     # Initial state: [h, l, vh, vl]
     y0 = [h0, l0, 0.0, -v0]
 
-    T_MAX = 50
-
     res = sciint.solve_ivp(derivatives, [0, T_MAX], y0,
-                           events=hit_plate, dense_output=True, max_step=0.01, rtol=1e-10, atol=1e-12)
+                           events=hit_plate, dense_output=True, max_step=MAX_STEP, rtol=RTOL, atol=ATOL)
 
     return res
 
 
-def impact_x(v0: float) -> float:
+def impact_x(v0: float, h0: float = H0, l0: float = L0) -> float:
     """
     Returns the l-coordinate where the charge hits the plate for a given v0.
     :param v0: Initial horizontal velocity
+    :param h0: Initial height from the metal plate
+    :param l0: Initial horizontal position
     :return: The l-coordinate at the moment of impact
     """
 
-    res = solve_trajectory(v0)
+    res = solve_trajectory(float(v0), float(h0), float(l0))
 
     # If the event was detected, use its l-value; otherwise use the last point.
     if res.t_events[0].size > 0:
@@ -96,6 +118,197 @@ def impact_x(v0: float) -> float:
         return res.y[1, -1]
 
 
+def impact_x_batch(v0_arr, h0: float = H0, l0: float = L0) -> np.ndarray:
+    """
+    Returns the impact l-coordinates of many v0 values, with one integration.
+    All K trajectories are advanced together as one (4K,) state vector, by stepping
+    the same RK45 solver that 'solve_ivp' uses. After every step, the trajectories which
+    crossed the 'hit_plate' threshold (from above) get their impact point from the dense output
+    of that step, and are frozen (their derivatives are set to zero), so they can not
+    blow up near the plate while the others are still moving.
+    The steps are shared, so they are set by the hardest trajectory, but with
+    max_step = 0.01 this hardly makes a difference.
+    :param v0_arr: Array of initial horizontal velocities
+    :param h0: Initial height from the metal plate
+    :param l0: Initial horizontal position
+    :return: Array of the l-coordinates at the moment of impact (or at T_MAX, if there is none)
+    """
+
+    v0 = np.atleast_1d(np.asarray(v0_arr, dtype=float))
+    K = v0.size
+
+    # Initial state: [h, l, vh, vl] of every trajectory
+    y0 = np.concatenate([np.full(K, h0), np.full(K, l0), np.zeros(K), -v0])
+
+    active = np.ones(K, dtype=bool)
+    x_impact = np.empty(K)
+
+    def frozen_derivatives(t, state):
+        d = derivatives(t, state)
+        d.reshape(4, K)[:, ~active] = 0.0
+        return d
+
+    solver = sciint.RK45(frozen_derivatives, 0, y0, T_MAX, max_step=MAX_STEP, rtol=RTOL, atol=ATOL)
+
+    while solver.status == "running" and active.any():
+        t_old, h_old = solver.t, solver.y[:K].copy()
+        message = solver.step()
+        if solver.status == "failed":
+            raise RuntimeError(f"The batched integration failed at t = {t_old}: {message}")
+
+        crossed = active & (h_old > H_PLATE) & (solver.y[:K] <= H_PLATE)
+        if not crossed.any():
+            continue
+
+        sol = solver.dense_output()
+        for k in np.flatnonzero(crossed):
+            t_hit = sciopt.brentq(lambda t: sol(t)[k] - H_PLATE, t_old, solver.t, xtol=4 * np.finfo(float).eps)
+            x_impact[k] = sol(t_hit)[K + k]
+
+        active &= ~crossed
+
+    # The ones that never reached the plate keep their last point, like in 'impact_x'
+    x_impact[active] = solver.y[K:2 * K][active]
+
+    return x_impact
+
+
+def ImpactKey(v0, h0, l0):
+    """
+    Makes the cache key of an impact point. The floats are written with repr, so they are read back exactly,
+    and every setting of the integration is part of it, so changing one does not give back old results.
+    """
+
+    return repr((float(v0), float(h0), float(l0), RTOL, ATOL, MAX_STEP, T_MAX, H_PLATE))
+
+
+def ImpactChunk(v0_chunk, h0, l0):
+    """
+    Computes one chunk of impact points, in a worker process.
+    """
+
+    return [float(impact_x(v0, h0, l0)) for v0 in v0_chunk]
+
+
+def scan_impact(v0_arr, h0: float = H0, l0: float = L0, workers=None, chunk: int = 8,
+                cache_file=CACHE_FILE) -> np.ndarray:
+    """
+    Maps 'impact_x' over the v0 values on a process pool. The results are kept in a cache
+    on disk, keyed by (v0, h0, l0, tolerances, T_MAX, H_PLATE), so only the missing v0 values are integrated,
+    and the cache is written after every finished chunk. If there is at most one chunk to do,
+    it is computed here, without starting the pool.
+    :param v0_arr: Array of initial horizontal velocities
+    :param h0: Initial height from the metal plate
+    :param l0: Initial horizontal position
+    :param workers: Number of worker processes, by default the number of CPUs
+    :param chunk: Number of v0 values per task
+    :param cache_file: Name of the JSON cache file, None to keep no cache
+    :return: Array of the impact l-coordinates
+    """
+
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as file:
+            cache = json.load(file)
+
+    v0 = np.atleast_1d(np.asarray(v0_arr, dtype=float))
+    todo = [v for v in dict.fromkeys(v0.tolist()) if ImpactKey(v, h0, l0) not in cache]
+    chunks = [todo[i:i + chunk] for i in range(0, len(todo), chunk)]
+
+    def store(v0_chunk, results):
+        cache.update((ImpactKey(v, h0, l0), x) for v, x in zip(v0_chunk, results))
+        if cache_file is not None:
+            tmp = cache_file + ".tmp"
+            with open(tmp, "w") as file:
+                json.dump(cache, file)
+            os.replace(tmp, cache_file)
+
+    if len(chunks) == 1 or workers == 1:
+        for v0_chunk in chunks:
+            store(v0_chunk, ImpactChunk(v0_chunk, h0, l0))
+    elif chunks:
+        context = multiprocessing.get_context("spawn")
+
+        with cf.ProcessPoolExecutor(workers, mp_context=context) as pool:
+            futures = {pool.submit(ImpactChunk, v0_chunk, h0, l0): v0_chunk for v0_chunk in chunks}
+
+            for future in cf.as_completed(futures):
+                store(futures[future], future.result())
+
+    return np.array([cache[ImpactKey(v, h0, l0)] for v in v0])
+
+
+def SplineBrackets(v0_data, f_data, f):
+    """
+    Makes the brackets of the roots of f from the samples. The CubicSpline of the samples
+    only tells where the roots are: every sample interval with a spline root is a bracket.
+    If the spline has more roots in one interval (e.g. two close ones, with no sign change
+    between the samples), the interval is split between them, with new evaluations of f.
+    :param v0_data: Sorted array of the sampled v0 values
+    :param f_data: Array of f at the samples
+    :param f: The function itself
+    :return: List of brackets (a, b, f(a), f(b)), with a sign change on each. A root which is
+        exactly on a sample point is given once, as the bracket (v, v, 0, 0).
+    """
+
+    cs = sciintp.CubicSpline(v0_data, f_data)
+    spline_roots = cs.solve(0.0, extrapolate=False)
+
+    brackets = []
+    intervals = np.clip(np.searchsorted(v0_data, spline_roots, side='right') - 1, 0, len(v0_data) - 2)
+
+    for i in np.unique(intervals):
+        roots = spline_roots[intervals == i]
+        points = [v0_data[i]] + [(r1 + r2) / 2 for r1, r2 in zip(roots[:-1], roots[1:])] + [v0_data[i + 1]]
+        values = [f_data[i]] + [f(v) for v in points[1:-1]] + [f_data[i + 1]]
+
+        for a, b, fa, fb in zip(points[:-1], points[1:], values[:-1], values[1:]):
+            # A zero on a sample point would be found from both intervals next to it
+            if fa == 0:
+                brackets.append((a, a, 0.0, 0.0))
+            elif fb == 0:
+                brackets.append((b, b, 0.0, 0.0))
+            elif fa * fb < 0:
+                brackets.append((a, b, fa, fb))
+
+    return list(dict.fromkeys(brackets))
+
+
+def refine_roots(v0_data, x_impact, h0: float = H0, l0: float = L0, xtol: float = 1e-12):
+    """
+    Finds the v0 values, where the charge lands below its starting point, impact_x(v0) = l0.
+    The spline of the samples is only used for bracketing (see 'SplineBrackets'), then
+    every root is refined with Brent's method directly on 'impact_x', so the accuracy is not
+    limited by the spline, and every root takes only about 10 more integrations.
+    :param v0_data: Sorted array of the sampled v0 values
+    :param x_impact: Array of the impact points at the samples
+    :param h0: Initial height from the metal plate
+    :param l0: Initial horizontal position
+    :param xtol: Requested accuracy of the roots
+    :return: Array of the roots, array of the impact points there, and the number of integrations of each root
+    """
+
+    def f(v0):
+        return impact_x(v0, h0, l0) - l0
+
+    v0_roots, calls = [], []
+
+    for a, b, fa, fb in SplineBrackets(np.asarray(v0_data, dtype=float), np.asarray(x_impact) - l0, f):
+        if fa == 0 or fb == 0:
+            v0_roots.append(a if fa == 0 else b)
+            calls.append(0)
+            continue
+
+        root, result = sciopt.brentq(f, a, b, xtol=xtol, full_output=True)
+        v0_roots.append(root)
+        calls.append(result.function_calls)
+
+    # These trajectories were just integrated by brentq, 'solve_trajectory' gives them back
+    x_at_roots = np.array([impact_x(v0, h0, l0) for v0 in v0_roots])
+
+    return np.array(v0_roots), x_at_roots, np.array(calls, dtype=int)
+
+
 # -------------------------------------------
 # Plotting Functions
 # -------------------------------------------
@@ -157,20 +370,20 @@ def plot_interactive(v0: float = 0.0):
     plt.show()
 
 
-def plot_impact_vs_v0():
+def plot_impact_vs_v0(parallel: bool = False):
     """
-    Plots the impact points.
+    Plots the impact points. The roots are labelled with the number of integrations brentq needed.
+    :param parallel: If True, the scan runs on a process pool with a cache on disk ('scan_impact'),
+        otherwise all trajectories are integrated together ('impact_x_batch')
+    :return: Array of the roots, array of the number of integrations of each
     """
 
     # Make v0 points
     v0_data = np.linspace(-2, 2, 100)
-    x_impact = np.array([impact_x(v) for v in v0_data])
-
-    # Build a CubicSpline of (v0, x_impact - L0) and solve for zeros.
-    cs = sciintp.CubicSpline(v0_data, x_impact - L0)
-    v0_roots = cs.solve(0.0, extrapolate=False)
+    x_impact = scan_impact(v0_data) if parallel else impact_x_batch(v0_data)
 
-    x_at_roots = np.array([impact_x(v) for v in v0_roots])
+    # The CubicSpline of (v0, x_impact - L0) brackets the zeros, and brentq refines them on impact_x
+    v0_roots, x_at_roots, calls = refine_roots(v0_data, x_impact)
 
     # --- Plot ---
     fig, ax = plt.subplots(figsize=(9, 5))
@@ -179,6 +392,10 @@ def plot_impact_vs_v0():
     ax.plot(v0_roots, x_at_roots, 'o', color='crimson', markersize=8, zorder=5, label=r'$x_{\mathrm{impact}} = x_0$')
     ax.axhline(y=L0, color='gray', linewidth=0.8, linestyle='--', alpha=0.7, label=f'Initial $x = {L0}$')
 
+    for v0, x, n in zip(v0_roots, x_at_roots, calls):
+        ax.annotate(rf'$v_0 = {v0:.10f}$ ({n} integrations)', (v0, x),
+                    textcoords="offset points", xytext=(8, -14), fontsize=9)
+
     ax.set_xlabel(r'$v_0$', fontsize=13)
     ax.set_ylabel(r'$x$', fontsize=13)
     ax.set_title(r'Impact $x$-coordinates', fontsize=14)
@@ -188,6 +405,8 @@ def plot_impact_vs_v0():
     plt.tight_layout()
     plt.show()
 
+    return v0_roots, calls
+
 
 # -------------------------------------------
 # Main